@@ -0,0 +1,349 @@
+#!/bin/python3
+
+# Microbenchmarks for the spellbook hot paths, run against synthetic data so
+# that results are comparable between machines. wrap uses the default spells
+# instead when they have been downloaded. Usage:
+#   python3 benchmark.py [name ...]
+
+import difflib
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import dataloaders
+import fuzzy
+import orcbrew
+import spellbook
+import utilities
+
+NAME_WORDS = [
+    "arcane",
+    "blade",
+    "bolt",
+    "chill",
+    "circle",
+    "cloud",
+    "cone",
+    "cure",
+    "dark",
+    "eldritch",
+    "fire",
+    "flame",
+    "frost",
+    "greater",
+    "guardian",
+    "hold",
+    "light",
+    "mighty",
+    "mind",
+    "orb",
+    "shadow",
+    "shield",
+    "spirit",
+    "storm",
+    "sword",
+    "touch",
+    "wall",
+    "ward",
+    "wave",
+    "word",
+]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def random_names(n, rng):
+    names = set()
+    while len(names) < n:
+        words = rng.sample(NAME_WORDS, rng.randint(2, 4))
+        names.add(" ".join(words) + " " + str(rng.randint(0, n)))
+    return sorted(names)
+
+
+def typo(name, rng):
+    chars = list(name)
+    for _ in range(rng.randint(1, 2)):
+        i = rng.randrange(len(chars))
+        op = rng.choice(["drop", "swap", "replace"])
+        if op == "drop" and len(chars) > 1:
+            del chars[i]
+        elif op == "swap" and i < len(chars) - 1:
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+        else:
+            chars[i] = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    return "".join(chars)
+
+
+def random_spells(n, rng):
+    schools = ["Abjuration", "Conjuration", "Evocation", "Illusion"]
+    classes = ["Bard", "Cleric", "Druid", "Sorcerer", "Warlock", "Wizard"]
+    durations = ["Instantaneous", "1 hour", "Concentration, up to 1 minute"]
+    return [
+        {
+            "name": name,
+            "school": rng.choice(schools),
+            "level": rng.randint(0, 9),
+            "cast": rng.choice(["1 action", "1 bonus action", "1 minute"]),
+            "range": rng.choice(["Self", "Touch", "60 feet", "120 feet"]),
+            "components": rng.choice(["V, S", "V, S, M (a feather)"]),
+            "duration": rng.choice(durations),
+            "description": " ".join(rng.choices(NAME_WORDS, k=80)),
+            "ritual": rng.random() < 0.1,
+            "classes": rng.sample(classes, rng.randint(1, 3)),
+            "subclasses": [],
+            "alt_names": [],
+        }
+        for name in random_names(n, rng)
+    ]
+
+
+class DictSpell:
+    """Spell as it was before __slots__ and interning, for comparison."""
+
+    def __init__(self, **kwargs):
+        self.name = kwargs.get("name", "N/A")
+        self.school = kwargs.get("school", "N/A")
+        self.level = kwargs.get("level", -1)
+        self.cast = kwargs.get("cast", "N/A")
+        self.range = kwargs.get("range", "N/A")
+        self.components = kwargs.get("components", "N/A")
+        self.duration = kwargs.get("duration", "N/A")
+        self.desc = kwargs.get("description", "N/A")
+        self.ritual = kwargs.get("ritual", False)
+        self.classes = kwargs.get("classes", [])
+        self.subclasses = kwargs.get("subclasses", [])
+        self.alt_names = kwargs.get("alt_names", [])
+
+
+def traced_size(build):
+    tracemalloc.start()
+    objects = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return size
+
+
+def bench_memory(n_spells=20000):
+    # Spells are built from freshly parsed JSON, as when loading spells.json,
+    # so repeated values start out as separate string objects. Only what the
+    # spells keep alive once the parsed JSON is freed is counted.
+    data = json.dumps(random_spells(n_spells, random.Random(0)))
+    spellbook._interned_lists.clear()
+
+    before = traced_size(lambda: [DictSpell(**s) for s in json.loads(data)])
+    after = traced_size(
+        lambda: [spellbook.Spell.from_json(s) for s in json.loads(data)]
+    )
+
+    print(f"memory: {n_spells} spells, retained size")
+    print(f"\tdict:          {before / n_spells:.0f} bytes per spell")
+    print(f"\tslots, intern: {after / n_spells:.0f} bytes per spell")
+    print(f"\tsaving:        {(before - after) / n_spells:.0f} bytes per spell")
+
+
+def bench_fuzzy(n_names=50000, n_queries=50):
+    rng = random.Random(0)
+    names = random_names(n_names, rng)
+    queries = [typo(rng.choice(names), rng) for _ in range(n_queries)]
+
+    matcher, build = timed(fuzzy.FuzzyMatcher, names)
+
+    def difflib_all():
+        return [
+            (m[0] if (m := difflib.get_close_matches(q, names, 1)) else None)
+            for q in queries
+        ]
+
+    def matcher_all():
+        return [matcher.match(q) for q in queries]
+
+    expected, difflib_time = timed(difflib_all)
+    actual, matcher_time = timed(matcher_all)
+    agree = sum(1 for e, a in zip(expected, actual) if e == a)
+
+    print(f"fuzzy: {n_names} names, {n_queries} misspelt queries")
+    print(f"\tdifflib:      {1000 * difflib_time / n_queries:.2f}ms per query")
+    print(
+        f"\tFuzzyMatcher: {1000 * matcher_time / n_queries:.2f}ms per query"
+        f" (index built in {build:.2f}s)"
+    )
+    print(f"\tagreement:    {agree}/{n_queries}")
+
+
+def random_orcbrew(n_spells, n_other, rng):
+    # Shaped like an OrcPub export of several plugins, where most of the file
+    # is races, feats and so on rather than spells.
+    import edn_format  # pylint: disable=import-error
+
+    kw = edn_format.Keyword
+
+    def spell(data):
+        return {
+            kw("key"): kw(data["name"].replace(" ", "-")),
+            kw("name"): data["name"],
+            kw("school"): data["school"].lower(),
+            kw("level"): data["level"],
+            kw("casting-time"): data["cast"],
+            kw("range"): data["range"],
+            kw("duration"): data["duration"],
+            kw("description"): data["description"] + ' "quoted" [1d6] {x}',
+            kw("components"): {
+                kw("verbal"): True,
+                kw("somatic"): rng.random() < 0.5,
+                kw("material"): False,
+            },
+            kw("spell-lists"): {kw(c.lower()): True for c in data["classes"]},
+        }
+
+    def other(i):
+        return {
+            kw("name"): f"Option {i}",
+            kw("description"): " ".join(rng.choices(NAME_WORDS, k=120)),
+            kw("traits"): [
+                {kw("name"): f"Trait {j}", kw("page"): j, kw("summary"): "\\"}
+                for j in range(8)
+            ],
+            kw("ability-increases"): {kw("str"): 2, kw("con"): 1.5},
+        }
+
+    spells = random_spells(n_spells, rng)
+    plugins = {}
+    for p in range(4):
+        plugin = {
+            kw(f"orcpub.dnd.e5/{kind}"): {
+                kw(f"{kind}-{p}-{i}"): other(i)
+                for i in range(n_other // 12)
+            }
+            for kind in ["races", "feats", "backgrounds"]
+        }
+        plugin[kw("orcpub.dnd.e5/spells")] = {
+            kw(f"spell-{i}"): spell(data)
+            for i, data in enumerate(spells[p::4])
+        }
+        plugins[f"Plugin {p}"] = plugin
+
+    return edn_format.dumps(plugins)
+
+
+def bench_orcbrew(n_spells=2000, n_other=20000):
+    try:
+        import edn_format  # pylint: disable=import-error
+    except ImportError:
+        print("orcbrew: edn_format isn't installed, skipping.")
+        return
+
+    text = random_orcbrew(n_spells, n_other, random.Random(0))
+
+    def edn_format_spells():
+        return [
+            spell
+            for plugin in edn_format.loads(text).values()
+            for spell in plugin[
+                edn_format.Keyword("orcpub.dnd.e5/spells")
+            ].values()
+        ]
+
+    def reader_spells():
+        return list(orcbrew.iter_spell_maps(text))
+
+    expected, edn_format_time = timed(edn_format_spells)
+    actual, reader_time = timed(reader_spells)
+    agree = [s[edn_format.Keyword("name")] for s in expected] == [
+        s["name"] for s in actual
+    ]
+
+    print(
+        f"orcbrew: {len(text) / 1e6:.1f}MB export,"
+        f" {n_spells} spells among {n_other} other entries"
+    )
+    print(f"\tedn_format: {edn_format_time:.2f}s")
+    print(f"\tReader:     {reader_time:.2f}s")
+    print(f"\tsame spells: {agree}")
+
+
+def printable_paragraph_concat(string, width):
+    """utilities.printable_paragraph as it was before wrap_lines."""
+
+    if len(string) > width:
+        out = ""
+        line = ""
+        word = ""
+        for c in string:
+            if len(line) + len(word) > width:
+                out += "\n" + line.strip()
+                line = ""
+
+            if c == " ":
+                line += f" {word}"
+                word = ""
+            elif c == "\n":
+                line += f" {word}"
+                word = ""
+                out += "\n" + line.strip()
+                line = ""
+            else:
+                word += c
+
+        out += "\n" + (line + " " + word).strip()
+
+        return out
+    else:
+        return string
+
+
+def bench_wrap(n_spells=20, widths=(40, 80, 120), repeat=20):
+    # The longest descriptions in the default spells, or synthetic ones of a
+    # similar length when spells.json hasn't been downloaded.
+    try:
+        spells = dataloaders.get_spells(prompt_download=False)
+        source = "spells.json"
+    except (FileNotFoundError, ValueError):
+        rng = random.Random(0)
+        spells = random_spells(n_spells, rng)
+        for spell in spells:
+            spell["description"] = " ".join(rng.choices(NAME_WORDS, k=1200))
+        source = "synthetic"
+    descriptions = sorted(
+        (spell.get("description", "") for spell in spells),
+        key=len,
+        reverse=True,
+    )[:n_spells]
+
+    def wrap_all(wrap):
+        return [
+            wrap(desc, width)
+            for _ in range(repeat)
+            for width in widths
+            for desc in descriptions
+        ]
+
+    _, concat_time = timed(wrap_all, printable_paragraph_concat)
+    _, lines_time = timed(wrap_all, utilities.printable_paragraph)
+    n = repeat * len(widths) * len(descriptions)
+
+    print(
+        f"wrap: {len(descriptions)} longest {source} descriptions, averaging"
+        f" {sum(map(len, descriptions)) // len(descriptions)} characters"
+    )
+    print(f"\tconcatenation: {1e6 * concat_time / n:.0f}us per paragraph")
+    print(f"\twrap_lines:    {1e6 * lines_time / n:.0f}us per paragraph")
+
+
+BENCHMARKS = {
+    "fuzzy": bench_fuzzy,
+    "memory": bench_memory,
+    "orcbrew": bench_orcbrew,
+    "wrap": bench_wrap,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
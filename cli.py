@@ -1,13 +1,16 @@
-import os  # get_terminal_size
-import re
+import collections
+import os
 import dataloaders
+import output
 import subprocess  # notes editor
+import sys
 import tempfile  # notes editor
 import utilities
 
 
 PS = "> "
 TRUNCATED = "..."
+TAB_WIDTH = 8  # columns, as most terminals display a tab
 
 # Text editing on linux is done through tempfile
 EDITOR_ENVIRONMENT_VARIABLE = "EDITOR"
@@ -16,11 +19,49 @@ EDITOR_FALLBACK = "vim" if os.name == "posix" else "notepad"
 # On windows, create a text file and have the user edit it
 EDITOR_FILE_PATH = "resources/note.txt"
 
+# Number of rendered spells to keep for printing again
+SPELL_CARD_CACHE_SIZE = 64
+
+# (spell name, print_classes, options) -> (spell, card, rolls), for the width
+# the cards were rendered at
+spell_card_cache = collections.OrderedDict()
+spell_card_width = None
+
 
 def print_spell(spell, width=None, print_classes=True, options=True):
+    global spell_card_width
+
     if width is None:
         width = get_width()
 
+    # Cards only fit the width they were rendered at
+    if width != spell_card_width:
+        spell_card_cache.clear()
+        spell_card_width = width
+
+    # Spells are replaced rather than changed in place, so a card is only
+    # reused for the same Spell object. Comparing contents would decode the
+    # stored fields of both spells.
+    key = (spell.name, print_classes, options)
+    cached = spell_card_cache.get(key)
+    if cached and cached[0] is spell:
+        spell_card_cache.move_to_end(key)
+        _, out, rolls = cached
+    else:
+        out, rolls = render_spell(spell, width, print_classes, options)
+        spell_card_cache[key] = (spell, out, rolls)
+        if len(spell_card_cache) > SPELL_CARD_CACHE_SIZE:
+            spell_card_cache.popitem(last=False)
+
+    print(out)
+
+    if options:
+        return "roll", list(rolls)  # opt
+
+
+def render_spell(spell, width, print_classes=True, options=True):
+    """Return the text of spell's card, and the rolls numbered in it."""
+
     out = ""
 
     if spell.level == 0:
@@ -60,15 +101,10 @@ def print_spell(spell, width=None, print_classes=True, options=True):
         out += f"\n{components}\n{duration}"
 
     desc = spell.desc
+    rolls = []
     if options:
-        temp_rolls = re.findall(r"(?<!increases by )(\d+d\d+)", desc)
-        rolls = []
-        for roll in temp_rolls:
-            if roll not in rolls:
-                rolls.append(roll)
-
-        for i, roll in enumerate(rolls):
-            desc = desc.replace(roll, f"{roll} [{i + 1}]", 1)
+        rolls = list(spell.dice.rolls)
+        desc = spell.dice.annotate(desc)
 
     out += f"\n{utilities.printable_paragraph(desc, width)}\n"
 
@@ -86,14 +122,11 @@ def print_spell(spell, width=None, print_classes=True, options=True):
                 class_str += subclasses
             out += f"\n{utilities.printable_paragraph(class_str, width)}\n"
 
-    print(out)
-
-    if options:
-        return "roll", rolls  # opt
+    return out, rolls
 
 
 def get_width(use_full_width=False):
-    width = os.get_terminal_size()[0]
+    width = output.terminal_width()
     if not use_full_width:
         if width < 60:
             pass
@@ -125,22 +158,135 @@ def print_prepped(char):
     return ("spell", opt)
 
 
-def print_list(title, items, afterword="", truncate_to=None):
-    print(f"\n{title}{':' if title[-1].isalpha() else ''}")
+def write(text):
+    """Output text in a single write, rather than a write per line."""
+
+    sys.stdout.write(text)
+
+
+def format_list(
+    title,
+    items,
+    afterword="",
+    truncate_to=None,
+    scores=None,
+    wrap_to=None,
+    start=1,
+):
+    lines = ["", f"{title}{':' if title[-1].isalpha() else ''}"]
 
     for i, item in enumerate(items):
-        line = f"\t[{i + 1}] {item}"
+        label = f"[{start + i}] "
+        line = f"{label}{item}"
+        if scores:
+            line += f" ({scores[i]:.2f})"
+
+        # truncate_to counts the tab before each line as a single character
         if truncate_to:
             line = (
-                line[: truncate_to - len(TRUNCATED)] + TRUNCATED
-                if len(line) > truncate_to
+                line[: truncate_to - 1 - len(TRUNCATED)] + TRUNCATED
+                if len(line) > truncate_to - 1
                 else line
             )
-        print(line)
+        elif wrap_to:
+            # Continuation lines are indented to line up after the label
+            line = "\n\t".join(
+                utilities.wrap_lines(
+                    line, wrap_to - TAB_WIDTH, " " * len(label)
+                )
+            )
+        lines.append(f"\t{line}")
 
     if afterword:
-        print(f"\n{afterword}")
-    print()
+        lines.extend(["", afterword])
+    lines.extend(["", ""])
+    return "\n".join(lines)
+
+
+def print_list(
+    title, items, afterword="", truncate_to=None, scores=None, wrap_to=None
+):
+    write(format_list(title, items, afterword, truncate_to, scores, wrap_to))
+
+
+class Pager:
+    """
+    Numbered list shown a page at a time. Items are numbered by their
+    position in the whole list, so that any item shown so far can be chosen
+    by its number as an option. The list is built up front; paging only
+    limits how much of it is formatted and printed at once.
+    """
+
+    def __init__(
+        self,
+        title,
+        items,
+        option_mode,
+        scores=None,
+        afterword="",
+        page_size=20,
+        wrap_to=None,
+    ):
+        self.title = title
+        self.items = list(items)
+        self.scores = list(scores) if scores else []
+        self.option_mode = option_mode
+        self.afterword = afterword
+        self.page_size = page_size
+        self.wrap_to = wrap_to
+        self.shown = 0  # number of items up to the end of the furthest page
+        self.page = 0
+
+    def __len__(self):
+        return self.shown
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def pages(self):
+        return max(1, -(-len(self.items) // self.page_size))
+
+    def show(self, page=None):
+        """Print a page, by default the current one, and return options."""
+
+        if page is not None:
+            self.page = page
+        start = self.page * self.page_size
+        end = start + self.page_size
+        self.shown = max(self.shown, min(end, len(self.items)))
+
+        footer = ""
+        if self.pages() > 1:
+            footer = f"Page {self.page + 1} of {self.pages()}."
+            if self.page > 0:
+                footer += ' Use "prev" for the previous page.'
+            if end < len(self.items):
+                footer += ' Use "next" for the next page.'
+        afterword = "\n".join(filter(None, [self.afterword, footer]))
+
+        write(
+            format_list(
+                self.title,
+                self.items[start:end],
+                afterword,
+                scores=self.scores[start:end],
+                wrap_to=self.wrap_to,
+                start=start + 1,
+            )
+        )
+        return (self.option_mode, self)
+
+    def next(self):
+        if self.page + 1 >= self.pages():
+            print("This is the last page.")
+            return None
+        return self.show(self.page + 1)
+
+    def prev(self):
+        if self.page == 0:
+            print("This is the first page.")
+            return None
+        return self.show(self.page - 1)
 
 
 def get_input(prompt, split=False, default=None):
@@ -225,6 +371,8 @@ def get_text_editor(default="", editor=None):
     if editor is None:
         editor = os.environ.get(EDITOR_ENVIRONMENT_VARIABLE, EDITOR_FALLBACK)
 
+    sys.stdout.flush()  # before the editor takes over the terminal
+
     if os.name == "posix":
         return get_text_editor_posix(default, editor)
     elif os.name == "nt":
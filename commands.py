@@ -8,10 +8,18 @@ import char
 import cli
 import constants
 import dataloaders
+import output
 import spellbook
+import spellserver
 import tracker
 import utilities
 
+# Number of search results listed at once
+SEARCH_PAGE_SIZE = 20
+
+# Number of results kept for searches ranked by description relevance
+SEARCH_RANKED_LIMIT = 5 * SEARCH_PAGE_SIZE
+
 
 # Decorator for functions which require an active character to work.
 def needschar(func):
@@ -121,7 +129,8 @@ def characters(context):
 
 
 def clear_screen(_):
-    utilities.clear_screen()
+    if output.interactive():
+        utilities.clear_screen()
 
 
 def tracker_collection(context):
@@ -209,6 +218,31 @@ def expertise(context):
     print(context.character.skills.proficiency(context, expertise=True))
 
 
+def import_spells(context):
+    if context.spellbook is None:
+        print("No spellbook available.")
+        return
+
+    path = context.raw_text.partition(" ")[2].strip()
+    rest, _, policy = path.rpartition(" ")
+    if policy in dataloaders.IMPORT_POLICIES:
+        path = rest.strip()
+    else:
+        policy = dataloaders.IMPORT_POLICIES[0]
+
+    if not path:
+        print(
+            "Usage: import <directory or glob> [policy], where policy is one"
+            f" of {utilities.punctuate_list(dataloaders.IMPORT_POLICIES)}."
+        )
+        return
+
+    try:
+        print(dataloaders.import_spell_packs(path, context.spellbook, policy))
+    except ValueError as e:
+        print(e)
+
+
 def info(context):
     spell = context.spellbook.get_spell(context.arg_text)
     if spell:
@@ -264,6 +298,47 @@ def load(context):
     print(f"Character loaded: {str(context.character)}.")
 
 
+def layer(context):
+    if context.spellbook is None:
+        print("No spellbook available.")
+        return
+
+    action = context.get_arg(0)
+    if action is None:
+        cli.print_list(
+            "Spellbook layers",
+            [
+                name + (f" ({path})" if path else "")
+                for name, path, _ in context.spellbook.layers
+            ],
+            context.spellbook.query_cache_info(),
+            wrap_to=cli.get_width(context.config["use_full_width"]),
+        )
+    elif action == "add" and context.arg_count() > 1:
+        path = context.raw_text.split(None, 2)[2]
+        name = os.path.basename(path)
+        try:
+            context.spellbook.attach(
+                name, os.path.abspath(path), dataloaders.load_spell_layer(path)
+            )
+        except ValueError as e:
+            print(f"Couldn't add layer. {e}")
+            return
+        print(f"Added layer {name}.")
+    elif action == "remove" and context.arg_count() > 1:
+        name = context.raw_text.split(None, 2)[2]
+        try:
+            context.spellbook.detach(name)
+        except ValueError as e:
+            print(f"Couldn't remove layer. {e}")
+            return
+        print(f"Removed layer {name}.")
+    else:
+        print(
+            "\nUsage:\n\tlayer\n\tlayer add <file>\n\tlayer remove <name>\n"
+        )
+
+
 def load_orcbrew(context):
     path = context.raw_text.replace("load_orcbrew", "", 1).strip()
     dataloaders.load_orcbrew(path, context.spellbook)
@@ -283,6 +358,14 @@ def newskill(context):
     print(context.character.skills.new_skill(name))
 
 
+def next_page(context):
+    if context.pager is None:
+        print("No results to page through. Try a search first.")
+        return
+
+    context.update_options(context.pager.next())
+
+
 @needschar
 def note(context):
     if context.arg_count() == 1 and context.get_arg(0).isnumeric():
@@ -380,6 +463,14 @@ def prepared(context):
         print('To prepare spells, start a character with "char".')
 
 
+def prev_page(context):
+    if context.pager is None:
+        print("No results to page through. Try a search first.")
+        return
+
+    context.update_options(context.pager.prev())
+
+
 @needschar
 def proficiencies(context):
     print(context.character.skills.skill_string(context.character))
@@ -522,11 +613,14 @@ def save(context):
 
 def search(context):
     try:
-        spells = context.spellbook.handle_query(context.arg_text)
+        results = context.spellbook.search(
+            context.arg_text, SEARCH_RANKED_LIMIT
+        )
     except ValueError as e:
         print(f"Invalid search. {e}")
         return
 
+    spells = results.spells
     if spells:
         if len(spells) == 1:
             opt = cli.print_spell(
@@ -538,9 +632,24 @@ def search(context):
 
             context.update_options(opt)
         else:
-            spell_names = [spell.name for spell in spells]
-            cli.print_list("Results", spell_names)
-            context.update_options(("spell", spell_names))
+            if results.total > len(spells):
+                afterword = (
+                    f"Showing the {len(spells)} most relevant of"
+                    f" {results.total} results."
+                )
+            else:
+                afterword = ""
+            context.pager = cli.Pager(
+                "Results",
+                [spell.name for spell in spells],
+                "spell",
+                scores=context.config["print_search_scores"]
+                and results.scores,
+                afterword=afterword,
+                page_size=SEARCH_PAGE_SIZE,
+                wrap_to=cli.get_width(context.config["use_full_width"]),
+            )
+            context.update_options(context.pager.show())
     else:
         print("Couldn't find any spells matching that description.")
 
@@ -694,7 +803,7 @@ def update_app():
     os.chdir(dataloaders.get_app_dir())
 
     try:
-        print("Updating...")
+        print("Updating...", flush=True)  # before git's own output
         subprocess.run("git stash", check=True, shell=True)
         subprocess.run("git pull", check=True, shell=True)
         print("Updated successfully! Restart spells to apply.")
@@ -706,9 +815,14 @@ def update_app():
 
 # Needs to accept context so it can be called directly
 def update_spells(context):
-    print("Downloading spell list...")
+    print("Downloading spell list...", flush=True)
     dataloaders.download_spells()
-    context.spellbook = spellbook.Spellbook()
+    layers = context.spellbook.layers[1:] if context.spellbook else []
+    context.spellbook = spellbook.LayeredSpellbook(
+        spellserver.open_spellbook()
+    )
+    for layer in layers:
+        context.spellbook.attach(*layer)
     print("Spell list updated.")
 
 
@@ -745,13 +859,17 @@ mapping = {
     "exp": expertise,
     "expertise": expertise,
     "i": info,
+    "import": import_spells,
     "info": info,
+    "layer": layer,
+    "layers": layer,
     "level": level_up,
     "levelup": level_up,
     "load": load,
     "load_orcbrew": load_orcbrew,
     "newchar": newchar,
     "newskill": newskill,
+    "next": next_page,
     "note": note,
     "notes": notes,
     "p": prepare,
@@ -760,6 +878,8 @@ mapping = {
     "prepare": prepare,
     "prepared": prepared,
     "prepped": prepared,
+    "prev": prev_page,
+    "previous": prev_page,
     "prof": proficiency,
     "proficiencies": proficiencies,
     "proficiency": proficiency,
@@ -0,0 +1,149 @@
+import os
+
+if os.name == "posix":
+    import readline  # also avoids arrow keys inputting escape characters
+else:
+    readline = None
+
+import commands
+import fuzzy
+import tracker
+
+# Commands taking a spell name, which may contain spaces
+SPELL_COMMANDS = {"c", "cast", "i", "info", "p", "prep", "prepare"}
+
+# Commands taking a skill name as their first argument
+SKILL_COMMANDS = {
+    "delskill",
+    "exp",
+    "expertise",
+    "prof",
+    "proficiency",
+    "sc",
+    "skillalt",
+    "skillcheck",
+}
+
+# Commands taking a tracker name as their first argument
+TRACKER_COMMANDS = {"collection", "deltracker", "dt", "t", "tc", "tracker"}
+
+
+def tracker_paths(collection):
+    """
+    Return every dotted path which names a tracker in collection. As trackers
+    are found with a breadth first search, paths can start at any depth.
+    """
+
+    separator = tracker.TrackerCollection.TRACKER_ACCESS_OPERATOR
+    paths = set()
+    for name, t in collection.trackers.items():
+        paths.add(name)
+        if isinstance(t, tracker.TrackerCollection):
+            for path in tracker_paths(t):
+                paths.add(path)
+                paths.add(f"{name}{separator}{path}")
+    return paths
+
+
+def skill_names(character):
+    # Skill arguments are a single word, so names with spaces can't be used
+    return {
+        name
+        for skill in character.skills.skills
+        for name in skill.alt_names
+        if " " not in name
+    }
+
+
+class Completer:
+    """
+    Tab completion for the prompt. Commands and tracker names complete the
+    first word, and spell, skill and tracker names complete the arguments of
+    the commands which take them. Spell names come from the tries the
+    spellbook keeps up to date itself; the character's trackers and skills
+    are few, so their tries are brought up to date by comparing against the
+    character before each completion.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.commands = fuzzy.PrefixTrie(commands.mapping.keys())
+        self.trackers = fuzzy.PrefixTrie()
+        self.tracker_paths = set()
+        self.skills = fuzzy.PrefixTrie()
+        self.skill_names = set()
+        self.matches = []
+
+    @staticmethod
+    def update(trie, old, new):
+        for name in old - new:
+            trie.remove(name)
+        for name in new - old:
+            trie.add(name)
+        return new
+
+    def refresh(self):
+        character = self.context.character
+        self.tracker_paths = Completer.update(
+            self.trackers,
+            self.tracker_paths,
+            tracker_paths(character.trackers) if character else set(),
+        )
+        self.skill_names = Completer.update(
+            self.skills,
+            self.skill_names,
+            skill_names(character) if character else set(),
+        )
+
+    def candidates(self, line):
+        """
+        Return the completions of the last word of line, each a replacement
+        for that word.
+        """
+
+        self.refresh()
+
+        command, space, argument = line.lstrip().partition(" ")
+        if not space:
+            return sorted(
+                set(self.commands.complete(command))
+                | set(self.trackers.complete(command))
+            )
+
+        argument = argument.lstrip()
+        word = argument.rpartition(" ")[2]
+        if command in SPELL_COMMANDS and self.context.spellbook:
+            start = len(argument) - len(word)
+            return [
+                name[start:]
+                for name in self.context.spellbook.complete(argument)
+            ]
+        elif word != argument:
+            return []
+        elif command in SKILL_COMMANDS:
+            return self.skills.complete(word)
+        elif command in TRACKER_COMMANDS:
+            return self.trackers.complete(word)
+        return []
+
+    def complete(self, text, state):
+        # Called by readline with increasing state until it returns None
+        if state == 0:
+            self.matches = self.candidates(
+                readline.get_line_buffer()[: readline.get_endidx()]
+            )
+        return self.matches[state] if state < len(self.matches) else None
+
+
+def install(context):
+    """Use a Completer for context for tab completion, where supported."""
+
+    if readline is None:
+        return
+
+    readline.set_completer(Completer(context).complete)
+    readline.set_completer_delims(" \t\n")
+    if "libedit" in (readline.__doc__ or ""):
+        readline.parse_and_bind("bind ^I rl_complete")  # macOS
+    else:
+        readline.parse_and_bind("tab: complete")
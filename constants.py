@@ -65,6 +65,8 @@ DEFAULT_CONFIG = {
     "note_editor_program": None,
     "print_spell_classes": True,
     "print_spell_rolls": True,
+    "print_search_scores": False,
     "print_stack_traces": False,
     "use_full_width": False,
+    "watch_spellbook": True,
 }
@@ -1,3 +1,4 @@
+import sys
 import traceback
 from typing import Any, List, Tuple
 
@@ -24,7 +25,9 @@ class Context:
         self.args = []
         self.option_mode = ""
         self.options = []
+        self.pager = None  # results of the last search, for next and prev
         self.previous_roll = None
+        self.spellbook_watcher = None
 
     def get_input(self, message="", string=None):
         try:
@@ -46,6 +49,7 @@ class Context:
         except Exception as e:
             print(f"Ran into issue parsing input: {e}.")
             if self.config["print_stack_traces"]:
+                sys.stdout.flush()  # before the traceback, on stderr
                 traceback.print_exc()
             self.raw_text = ""
             self.arg_text = ""
@@ -64,6 +68,9 @@ class Context:
     def has_args(self):
         return self.arg_count() != 0
 
+    def spellbook_layers(self):
+        return self.spellbook.layer_paths() if self.spellbook else []
+
     def save(self):
         if self.character:
             self.save_file = dataloaders.save_character(
@@ -73,9 +80,14 @@ class Context:
                 not dataloaders.in_saves_dir(self.save_file)
             ):
                 self.save_files.append(self.save_file)
-            dataloaders.save_cache(self.save_file, self.save_files)
+            dataloaders.save_cache(
+                self.save_file, self.save_files, self.spellbook_layers()
+            )
         else:
-            dataloaders.save_cache(save_files=self.save_files)
+            dataloaders.save_cache(
+                save_files=self.save_files,
+                spellbook_layers=self.spellbook_layers(),
+            )
         dataloaders.save_config(self.config)
 
     def update_options(self, option_tuple: Tuple[str, List[Any]]):
@@ -157,7 +169,40 @@ class Context:
     def spellbook_check(self):
         return True if self.spellbook else False
 
+    def check_spellbook(self):
+        """
+        Drop the spellbook if loading it in the background failed, rather
+        than serving the spells read before the failure. Returns whether the
+        spellbook is still usable.
+        """
+
+        if self.spellbook and self.spellbook.load_failed():
+            print("Spellbook file corrupted. No Spellbook available.")
+            self.spellbook = None
+            return False
+        return True
+
+    def reload_spellbook(self):
+        if not (
+            self.spellbook_watcher
+            and self.spellbook_watcher.changed()
+            and self.spellbook
+        ):
+            return
+
+        try:
+            if summary := self.spellbook.reload():
+                print(f"Reloaded spells.json: {summary}")
+        except Exception as e:
+            print(f"Failed to reload spells.json: {e}.")
+            if self.config["print_stack_traces"]:
+                sys.stdout.flush()  # before the traceback, on stderr
+                traceback.print_exc()
+
     def handle_command(self):
+        if self.check_spellbook():
+            self.reload_spellbook()
+
         try:
             if not self.command:
                 return
@@ -217,6 +262,10 @@ class Context:
                 else:
                     print(f"Unknown command: {self.command}.")
         except Exception as e:
+            # The background load may have failed partway through the command
+            if not self.check_spellbook():
+                return
             print(f"Ran into issue executing command: {e}.")
             if self.config["print_stack_traces"]:
+                sys.stdout.flush()  # before the traceback, on stderr
                 traceback.print_exc()
@@ -1,15 +1,25 @@
 from ast import expr_context
+import collections
+import concurrent.futures
+import glob
+import hashlib
 import importlib
 import json
+import multiprocessing
 import os
+import re
 import subprocess
 import sys
+import tempfile
+import textwrap
 from typing import List, Optional, Tuple
 import urllib.request
 
 import cli
 import constants
+import orcbrew
 import spellbook
+import spellstore
 import utilities
 
 
@@ -20,22 +30,41 @@ DEFAULT_SPELLBOOK_URL = (
 
 RESOURCE_DIR = "resources"
 RESOURCE_SPELLBOOK_FILE = "spells.json"
+RESOURCE_SPELLBOOK_SNAPSHOT_FILE = "spells.snapshot"
+RESOURCE_SPELLBOOK_SOCKET_FILE = "spells.sock"
 RESOURCE_CACHE_FILE = "cache.json"
 RESOURCE_CONFIG_FILE = "config.json"
+RESOURCE_SAVES_MANIFEST_FILE = "saves.json"
 
 SAVES_DIR = "saves"
 
+# Characters of spells.json read at a time when streaming it
+SPELLBOOK_READ_SIZE = 1 << 16
+
+JSON_WHITESPACE_REGEX = re.compile(r"[ \t\n\r]*")
+JSON_NUMBER_TAIL_REGEX = re.compile(r"[0-9.eE+-]*")
+
+# Ways to settle an imported spell having the same name as another spell:
+# keep the spellbook's spell, take whichever file is newer or keep both.
+IMPORT_POLICIES = ["prefer-source", "prefer-newest", "keep-both"]
+
+# Bump when the pickled layout of the spellbook changes
+SPELLBOOK_SNAPSHOT_VERSION = 16
+
 
 class SaveFile:
-    def __init__(self, path: str) -> None:
+    def __init__(
+        self,
+        path: str,
+        name: Optional[str] = None,
+        klasses: Optional[List[str]] = None,
+    ) -> None:
         self.path: str = path
-        data = load_character_from_path(path)
-        self.name: str = data["name"]
-        self.klasses: List[str] = []
-        for klasse in data.get("classes", []):
-            self.klasses.append(
-                klasse.get("name").capitalize() + " " + str(klasse.get("level"))
-            )
+        if name is None:
+            data = load_character_from_path(self.full_path())
+            name, klasses = SaveFile.summary(data)
+        self.name: str = name
+        self.klasses: List[str] = klasses or []
 
     def __str__(self) -> str:
         string = self.name.capitalize()
@@ -45,11 +74,17 @@ class SaveFile:
 
         return f"{string}\t({self.path})"
 
+    @staticmethod
+    def summary(data: dict) -> Tuple[str, List[str]]:
+        """Return the name and class strings of a saved character."""
+
+        return data["name"], [
+            klasse.get("name").capitalize() + " " + str(klasse.get("level"))
+            for klasse in data.get("classes", [])
+        ]
+
     def full_path(self) -> str:
-        if self.path.startswith("saves/"):
-            return get_real_path(self.path)
-        else:
-            return self.path
+        return full_save_path(self.path)
 
     def klasse_str(self) -> str:
         return ", ".join(self.klasses)
@@ -84,6 +119,16 @@ def spells_file() -> str:
     return ensure_path(RESOURCE_DIR, RESOURCE_SPELLBOOK_FILE)
 
 
+def spells_file_stat() -> Optional[Tuple[int, int]]:
+    """Return the mtime and size of spells.json, or None if it's missing."""
+
+    try:
+        stat = os.stat(spells_file())
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
 def download_spells() -> None:
     with urllib.request.urlopen(DEFAULT_SPELLBOOK_URL) as f:
         data = f.read().decode("utf-8")
@@ -92,14 +137,189 @@ def download_spells() -> None:
 
 
 def get_spells(prompt_download=True):
+    return list(iter_spells(prompt_download))
+
+
+def iter_spells(prompt_download=True):
+    """
+    Return an iterator over the spells in spells.json, each parsed as it is
+    read rather than loading the whole file first. The file is opened
+    immediately, so a missing spellbook raises FileNotFoundError here rather
+    than during iteration.
+    """
+
     if not os.path.exists(spells_file()):
         if prompt_download and cli.get_decision(
             "No spellbook found. Download default?"
         ):
             download_spells()
 
-    with open(spells_file(), "r") as f:
-        return json.load(f)
+    return stream_json_array(open(spells_file(), "r"))
+
+
+def stream_json_array(f, read_size=SPELLBOOK_READ_SIZE):
+    """
+    Yield the elements of the JSON array in file f one at a time, keeping
+    only the unparsed part of the file in memory, then close f. Raises
+    json.JSONDecodeError if the file isn't a JSON array.
+    """
+
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    expected = "["  # then "value", or "," / "]" between values
+
+    def error(message):
+        return json.JSONDecodeError(message, buffer, pos)
+
+    with f:
+        while True:
+            pos = JSON_WHITESPACE_REGEX.match(buffer, pos).end()
+            if pos == len(buffer):
+                if not (chunk := f.read(read_size)):
+                    raise error("Unexpected end of file")
+                buffer = chunk
+                pos = 0
+                continue
+
+            char = buffer[pos]
+            if expected == "[":
+                if char != "[":
+                    raise error("Expecting '['")
+                pos += 1
+                expected = "value or ]"
+            elif char == "]" and expected != "value":
+                return
+            elif expected == ",":
+                if char != ",":
+                    raise error("Expecting ',' delimiter")
+                pos += 1
+                expected = "value"
+            else:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    end = None
+
+                # A value at the end of the buffer may have been cut short,
+                # e.g. "1.5" read as "1", so read more and try again. Read at
+                # least as much again so that long values aren't reparsed for
+                # every chunk.
+                if (
+                    end is None
+                    or JSON_NUMBER_TAIL_REGEX.match(buffer, end).end()
+                    == len(buffer)
+                ):
+                    chunk = f.read(max(read_size, len(buffer) - pos))
+                    if chunk:
+                        buffer = buffer[pos:] + chunk
+                        pos = 0
+                        continue
+                    if end is None:
+                        value, end = decoder.raw_decode(buffer, pos)
+
+                pos = end
+                expected = ","
+                yield value
+
+
+def save_spells(sb) -> None:
+    """
+    Write the spellbook to spells.json, one spell at a time, through a
+    temporary file which replaces the old spellbook once it is complete.
+    Produces the same output as json.dump(sb.get_spells_json(), f, indent=4).
+    """
+
+    path = spells_file()
+    with tempfile.NamedTemporaryFile(
+        "w", dir=os.path.dirname(path), suffix=".tmp", delete=False
+    ) as f:
+        try:
+            separator = "[\n"
+            for spell in sb.iter_spells_json():
+                f.write(separator)
+                f.write(textwrap.indent(json.dumps(spell, indent=4), "    "))
+                separator = ",\n"
+            f.write("[]" if separator == "[\n" else "\n]")
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+
+    if os.path.exists(path):
+        # NamedTemporaryFile is private to the user, keep the old permissions
+        os.chmod(f.name, os.stat(path).st_mode)
+    os.replace(f.name, path)
+    sb.mark_saved()
+    sb.save_snapshot()
+
+
+def spells_snapshot_file() -> str:
+    return ensure_path(RESOURCE_DIR, RESOURCE_SPELLBOOK_SNAPSHOT_FILE)
+
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def load_spellbook_snapshot() -> Optional[dict]:
+    """
+    Return the spellbook state stored by save_spellbook_snapshot, or None if
+    there is no snapshot or spells.json has changed since it was written.
+    Large spell fields in the returned state are read lazily from the
+    memory-mapped snapshot file.
+    """
+
+    try:
+        stat = os.stat(spells_file())
+        store = spellstore.Store(spells_snapshot_file())
+    except Exception:
+        return None
+
+    meta = store.meta
+    if meta.get("version") != SPELLBOOK_SNAPSHOT_VERSION:
+        store.close()
+        return None
+
+    touched = (meta["mtime"], meta["size"]) != (stat.st_mtime_ns, stat.st_size)
+    # Touched but not edited, e.g. by a git checkout; keep the snapshot and
+    # record the new mtime so the hash isn't needed next time.
+    if touched and meta["digest"] != file_digest(spells_file()):
+        store.close()
+        return None
+
+    try:
+        state = store.load()
+    except Exception:
+        return None
+
+    if touched:
+        save_spellbook_snapshot(state)
+    return state
+
+
+def save_spellbook_snapshot(state: dict) -> None:
+    path = spells_snapshot_file()
+    try:
+        stat = os.stat(spells_file())
+        spellstore.dump(
+            {
+                "version": SPELLBOOK_SNAPSHOT_VERSION,
+                "mtime": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "digest": file_digest(spells_file()),
+            },
+            state,
+            path + ".tmp",
+        )
+        os.replace(path + ".tmp", path)
+    except Exception:
+        # The snapshot is only an optimisation, e.g. pickling may fail
+        try:
+            os.remove(path + ".tmp")
+        except OSError:
+            pass
 
 
 def load_character(name):
@@ -112,8 +332,10 @@ def save_character(char, path=None):
     if not path:
         path = ensure_path(SAVES_DIR, f"{char.name.lower()}.json")
 
+    data = char.to_json()
     with open(path, "w") as f:
-        json.dump(char.to_json(), f, indent=4)
+        json.dump(data, f, indent=4)
+    update_saves_manifest(path, data)
 
     return path
 
@@ -128,6 +350,7 @@ def delete_character(char):
     char_file = ensure_path(SAVES_DIR, f"{char.lower()}.json")
     if os.path.exists(char_file):
         os.remove(char_file)
+        update_saves_manifest(char_file)
         print(f"Deleted character {char}.")
     else:
         print(f'No character "{char}" found.')
@@ -144,27 +367,135 @@ def load_character_from_path(path):
     raise FileNotFoundError
 
 
-def current_chars(save_files: Optional[List[str]] = None) -> List[SaveFile]:
-    saves = []
+def full_save_path(path: str) -> str:
+    if path.startswith("saves/"):
+        return get_real_path(path)
+    else:
+        return path
 
-    save_files = save_files[:] or []
-    save_files.extend(
-        map(lambda f: f"saves/{f}", os.listdir(get_real_path(SAVES_DIR)))
-    )
-    for path in save_files:
+
+def saves_manifest_key(path: str) -> str:
+    # Saves in the saves directory are listed as saves/<file>
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(
+        get_real_path(SAVES_DIR)
+    ):
+        return f"{SAVES_DIR}/{os.path.basename(path)}"
+    return path
+
+
+def saves_manifest_file() -> str:
+    return ensure_path(RESOURCE_DIR, RESOURCE_SAVES_MANIFEST_FILE)
+
+
+def load_saves_manifest() -> dict:
+    try:
+        with open(saves_manifest_file(), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+
+
+def save_saves_manifest(manifest: dict) -> None:
+    path = saves_manifest_file()
+    try:
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass  # The manifest is only an optimisation
+
+
+def manifest_entry(stat: os.stat_result, name: str, klasses: List[str]) -> dict:
+    return {
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "name": name,
+        "classes": klasses,
+    }
+
+
+def update_saves_manifest(path: str, data: Optional[dict] = None) -> None:
+    """
+    Record the character data just saved to path in the manifest, or remove
+    path from the manifest if data is None.
+    """
+
+    manifest = load_saves_manifest()
+    key = saves_manifest_key(path)
+    if data is None:
+        manifest.pop(key, None)
+    else:
         try:
-            saves.append(SaveFile(path))
-        except (KeyError, json.JSONDecodeError):
-            if cli.get_decision(f"Corrupted save file: {path}, delete?"):
-                os.remove(get_real_path(path))
-        except FileNotFoundError:
+            manifest[key] = manifest_entry(
+                os.stat(path), *SaveFile.summary(data)
+            )
+        except (OSError, KeyError):
+            manifest.pop(key, None)
+    save_saves_manifest(manifest)
+
+
+def current_saves(save_files: Optional[List[str]] = None) -> dict:
+    """
+    Return the manifest entries, with name and classes, of the saves in the
+    saves directory and save_files. Only saves which have changed since the
+    manifest was written, going by their mtime and size, are read.
+    """
+
+    stats = {}  # path -> os.stat_result
+    for path in save_files or []:
+        try:
+            stats[saves_manifest_key(path)] = os.stat(full_save_path(path))
+        except OSError:
             pass
+    with os.scandir(ensure_dir(SAVES_DIR)) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stats[f"{SAVES_DIR}/{entry.name}"] = entry.stat()
+
+    manifest = load_saves_manifest()
+    saves = {}
+    for path, stat in stats.items():
+        entry = manifest.get(path)
+        if entry is None or (entry["mtime"], entry["size"]) != (
+            stat.st_mtime_ns,
+            stat.st_size,
+        ):
+            try:
+                data = load_character_from_path(full_save_path(path))
+                entry = manifest_entry(stat, *SaveFile.summary(data))
+            except (KeyError, TypeError, json.JSONDecodeError):
+                if cli.get_decision(f"Corrupted save file: {path}, delete?"):
+                    os.remove(full_save_path(path))
+                continue
+            except FileNotFoundError:
+                continue
+        saves[path] = entry
+
+    # Saves outside the saves directory are kept until they're checked
+    updated = {
+        path: entry
+        for path, entry in manifest.items()
+        if path not in stats and not path.startswith(f"{SAVES_DIR}/")
+    }
+    updated.update(saves)
+    if updated != manifest:
+        save_saves_manifest(updated)
 
     return saves
 
 
+def current_chars(save_files: Optional[List[str]] = None) -> List[SaveFile]:
+    return [
+        SaveFile(path, entry["name"], entry["classes"])
+        for path, entry in current_saves(save_files).items()
+    ]
+
+
 def save_exists(name: str) -> bool:
-    return name.lower() in [save.name.lower() for save in current_chars()]
+    return any(
+        entry["name"].lower() == name.lower()
+        for entry in current_saves().values()
+    )
 
 
 def get_cache():
@@ -174,16 +505,23 @@ def get_cache():
         ) as f:
             return json.load(f)
     except (FileNotFoundError, json.decoder.JSONDecodeError):
-        return {"character": None, "save_files": []}
+        return {"character": None, "save_files": [], "spellbook_layers": []}
 
 
-def save_cache(path=None, save_files=None):
+def save_cache(path=None, save_files=None, spellbook_layers=None):
     resources_path = get_real_path("resources")
     if not os.path.exists(resources_path):
         os.mkdir(resources_path)
 
     with open(ensure_path(RESOURCE_DIR, RESOURCE_CACHE_FILE), "w") as f:
-        json.dump({"character": path, "save_files": save_files or []}, f)
+        json.dump(
+            {
+                "character": path,
+                "save_files": save_files or [],
+                "spellbook_layers": spellbook_layers or [],
+            },
+            f,
+        )
 
 
 def clear_cache():
@@ -249,123 +587,202 @@ def ensure_module_installed(module):
         raise SystemExit
 
 
-def load_orcbrew(path, sb):
-    ensure_module_installed("edn_format")
-    import edn_format  # pylint: disable=import-error
+def parse_orcbrew(path):
+    """Return the spells in an orcbrew file, or None if it can't be read."""
 
     try:
         with open(path, "rb") as f:
-            binary = f.read()
-            data = edn_format.loads(binary.decode("utf-8", "ignore"))
+            text = f.read().decode("utf-8", "ignore")
+        return [
+            spellbook.Spell.from_json(spell)
+            for spell in orcbrew.iter_spells_json(text)
+        ]
     except FileNotFoundError:
         print(f'Couldn\'t find an orcbrew at "{path}".')
-        return
-    except edn_format.EDNDecodeError:
+    except (orcbrew.EDNDecodeError, KeyError, AttributeError):
         print("Failed to read the orcbrew file.")
+    return None
+
+
+def load_orcbrew(path, sb):
+    new_spells = parse_orcbrew(path)
+    if new_spells is None:
         return
 
-    spells = data[edn_format.Keyword("orcpub.dnd.e5/spells")]
-
-    keywords = {
-        kw: edn_format.Keyword(kw)
-        for kw in [
-            "name",
-            "school",
-            "level",
-            "casting-time",
-            "range",
-            "duration",
-            "components",
-            "verbal",
-            "somatic",
-            "material",
-            "material-component",
-            "duration",
-            "description",
-            "spell-lists",
-        ]
-    }
+    if cli.get_decision(
+        f"Found {len(new_spells)} spells. Add these to your spellbook?"
+    ):
+        sb.add_spells(new_spells)
+        if cli.get_decision('Add these spells to "spells.json"?'):
+            save_spells(sb)
 
-    classes = {
-        kw: edn_format.Keyword(kw.lower())
-        for kw in [
-            "Bard",
-            "Cleric",
-            "Druid",
-            "Paladin",
-            "Ranger",
-            "Sorcerer",
-            "Warlock",
-            "Wizard",
-        ]
-    }
 
-    kw = lambda w: keywords[w]
-
-    new_spells = []
-    for spell in spells.values():
-        spell_json = {
-            w: utilities.replace_unicode(spell[kw(w)])
-            if type(spell[kw(w)]) == str
-            else spell[kw(w)]
-            for w in [
-                "name",
-                "school",
-                "level",
-                "casting-time",
-                "range",
-                "description",
-            ]
-        }
+def load_spell_layer(path):
+    """
+    Build a spellbook from a JSON spell list, formatted like spells.json, or
+    an orcbrew file. Raises ValueError if the file can't be read.
+    """
 
-        if kw("duration") in spell:
-            spell_json["duration"] = spell[kw("duration")]
-        else:
-            spell_json["duration"] = "Instantaneous"
+    if path.endswith(".orcbrew"):
+        spells = parse_orcbrew(path)
+        if spells is None:
+            raise ValueError(f'Couldn\'t load spells from "{path}".')
+    else:
+        try:
+            with open(path, "r") as f:
+                spells = [spellbook.Spell.from_json(s) for s in json.load(f)]
+        except (OSError, ValueError, TypeError) as e:
+            raise ValueError(f'Couldn\'t load spells from "{path}".') from e
 
-        spell_json["cast"] = spell_json["casting-time"]
-        del spell_json["casting-time"]
+    return spellbook.Spellbook(spells)
 
-        components = spell[kw("components")]
-        component_string = ", ".join(
-            [
-                c[0].upper()
-                for c in ["verbal", "somatic", "material"]
-                if components.get(kw(c))
-            ]
-        )
-        material = components.get(kw("material-component"))
-        if material:
-            component_string += f" ({material})"
 
-            # some of the entries end in a closing bracket
-            # for no discernible reason.
-            if component_string[-2:] == "))" and component_string.count(
-                "("
-            ) != component_string.count(")"):
+def spell_pack_paths(pattern):
+    """Return the orcbrew and JSON files in a directory or matching a glob."""
 
-                component_string = component_string[:-1]
-        spell_json["components"] = component_string
+    pattern = os.path.expanduser(pattern)
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*")
 
-        spell_classes = []
-        spell_lists = spell[kw("spell-lists")]
-        for c in classes:
-            if spell_lists[classes[c]]:
-                spell_classes.append(c)
-        spell_json["classes"] = spell_classes
+    return sorted(
+        path
+        for path in glob.glob(pattern)
+        if os.path.splitext(path)[1] in (".orcbrew", ".json")
+        and os.path.isfile(path)
+    )
 
-        spell_json["ritual"] = False
-        spell_json["alt_names"] = []
-        spell_json["subclasses"] = []
 
-        new_spells.append(spellbook.Spell.from_json(spell_json))
+def read_spell_pack(path):
+    """
+    Return (mtime, spells, error) for an orcbrew or JSON file of spells, with
+    the spells in the spells.json format. Runs in a worker process, so errors
+    are returned rather than raised.
+    """
 
-    if cli.get_decision(
-        f"Found {len(new_spells)} spells. Add these to your spellbook?"
-    ):
-        sb.add_spells(new_spells)
-        if cli.get_decision('Add these spells to "spells.json"?'):
-            with open(
-                ensure_path(RESOURCE_DIR, RESOURCE_SPELLBOOK_FILE), "w"
-            ) as f:
-                json.dump(sb.get_spells_json(), f, indent=4)
+    try:
+        mtime = os.stat(path).st_mtime
+        with open(path, "rb") as f:
+            text = f.read().decode("utf-8", "ignore")
+
+        if path.endswith(".orcbrew"):
+            spells = list(orcbrew.iter_spells_json(text))
+        else:
+            spells = json.loads(text)
+            if not all(isinstance(spell, dict) for spell in spells):
+                raise ValueError("expected a list of spells")
+        return mtime, spells, None
+    except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+        return None, None, str(e) or type(e).__name__
+
+
+def read_spell_packs(paths):
+    """
+    Yield the result of read_spell_pack for each path in order, each as soon
+    as it and the files before it have been read.
+    """
+
+    # Workers are spawned rather than forked, as forking while the spellbook
+    # loader and file watcher threads run can copy locks they hold
+    if len(paths) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            yield from executor.map(read_spell_pack, paths)
+    else:
+        yield from map(read_spell_pack, paths)
+
+
+def import_spell_packs(pattern, sb, policy=IMPORT_POLICIES[0]):
+    """
+    Add the spells in every orcbrew and JSON file in a directory or matching
+    a glob to the spellbook and spells.json, settling spells with the same
+    name according to policy. The files are read in parallel and the
+    spellbook is saved once at the end. Returns a summary of the import.
+    """
+
+    if policy not in IMPORT_POLICIES:
+        raise ValueError(
+            f'Unknown policy "{policy}". Options are'
+            f" {utilities.punctuate_list(IMPORT_POLICIES)}."
+        )
+
+    if not (paths := spell_pack_paths(pattern)):
+        raise ValueError(f'No orcbrew or JSON files found at "{pattern}".')
+
+    try:
+        source_mtime = os.stat(spells_file()).st_mtime
+    except OSError:
+        source_mtime = 0
+
+    # Fetched once, as a spellbook server sends the whole map on each access
+    digests = sb.digests
+    chosen = {}  # lowercase name -> (mtime, spell, digest) of spells to add
+    copies = set()  # lowercase names of spells kept alongside another
+    counts = collections.Counter()
+    failed = 0
+    for path, (mtime, spells, error) in zip(paths, read_spell_packs(paths)):
+        if error is not None:
+            print(f'Failed to read "{path}": {error}.', flush=True)
+            failed += 1
+            continue
+
+        pack = os.path.splitext(os.path.basename(path))[0]
+        for data in spells:
+            spell = spellbook.Spell.from_json(data)
+            digest = spell.digest()
+            key = spell.name.lower()
+
+            if key in chosen:
+                current_mtime, _, current_digest = chosen[key]
+            elif key in digests:
+                current_mtime = source_mtime
+                current_digest = digests[key]
+            else:
+                chosen[key] = (mtime, spell, digest)
+                continue
+
+            if digest == current_digest:
+                counts["unchanged"] += 1
+            elif policy == "keep-both":
+                spell.name = unused_spell_name(
+                    f"{spell.name} ({pack})", chosen, sb
+                )
+                chosen[spell.name.lower()] = (mtime, spell, spell.digest())
+                copies.add(spell.name.lower())
+            elif policy == "prefer-newest" and mtime > current_mtime:
+                # Replacing a spell from an older file skips that spell
+                counts["skipped"] += key in chosen
+                chosen[key] = (mtime, spell, digest)
+            else:
+                counts["skipped"] += 1
+
+    for key in chosen:
+        if key in copies:
+            counts["copied"] += 1
+        elif key in digests:
+            counts["replaced"] += 1
+        else:
+            counts["added"] += 1
+    sb.put_spells(
+        [spell for _, spell, _ in chosen.values()],
+        [digest for _, _, digest in chosen.values()],
+    )
+    if chosen:
+        save_spells(sb)
+
+    return (
+        f"Imported {len(paths) - failed} of {len(paths)} files."
+        f" {counts['added']} spells added, {counts['replaced']} replaced,"
+        f" {counts['copied']} kept alongside spells of the same name,"
+        f" {counts['skipped']} conflicting spells skipped and"
+        f" {counts['unchanged']} already present."
+    )
+
+
+def unused_spell_name(name, chosen, sb):
+    candidate = name
+    i = 2
+    while candidate.lower() in chosen or candidate in sb:
+        candidate = f"{name} {i}"
+        i += 1
+    return candidate
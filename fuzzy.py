@@ -0,0 +1,264 @@
+import array
+import collections
+import difflib
+import heapq
+
+import spellindex
+
+
+class TrieNode:
+    __slots__ = ["label", "value", "children"]
+
+    def __init__(self, label="", value=None):
+        self.label = label  # the part of the key leading from the parent
+        self.value = value
+        self.children = {}  # first character of label -> node
+
+
+class PrefixTrie:
+    """
+    Map from lowercase keys to names, which can list every name whose key
+    starts with a prefix in time proportional to the length of the prefix
+    and the number of results. Runs of nodes with a single child are merged
+    into one edge, so a trie of spell names has about one node per name.
+    """
+
+    def __init__(self, names=None):
+        self.root = TrieNode()
+        self.size = 0
+
+        for name in names or []:
+            self.add(name)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        return self.size
+
+    def get(self, name):
+        key = name.lower()
+        node = self.root
+        i = 0
+        while i < len(key):
+            node = node.children.get(key[i])
+            if node is None or not key.startswith(node.label, i):
+                return None
+            i += len(node.label)
+        return node.value
+
+    def add(self, name):
+        key = name.lower()
+        node = self.root
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None:
+                node.children[key[i]] = TrieNode(key[i:], name)
+                self.size += 1
+                return
+
+            common = 0
+            limit = min(len(child.label), len(key) - i)
+            while common < limit and child.label[common] == key[i + common]:
+                common += 1
+
+            if common < len(child.label):
+                split = TrieNode(child.label[:common])
+                child.label = child.label[common:]
+                split.children[child.label[0]] = child
+                node.children[key[i]] = split
+                child = split
+
+            node = child
+            i += common
+
+        if node.value is None:
+            self.size += 1
+        node.value = name
+
+    def remove(self, name):
+        key = name.lower()
+        path = [self.root]
+        i = 0
+        while i < len(key):
+            node = path[-1].children.get(key[i])
+            if node is None or not key.startswith(node.label, i):
+                return
+            path.append(node)
+            i += len(node.label)
+
+        node = path[-1]
+        if node.value is None:
+            return
+        node.value = None
+        self.size -= 1
+
+        # Remove the node if it's now a dead end, and merge whichever node is
+        # left with a single child into that child.
+        if len(path) > 1 and not node.children:
+            del path[-2].children[node.label[0]]
+            path.pop()
+        node = path[-1]
+        if len(path) > 1 and node.value is None and len(node.children) == 1:
+            (child,) = node.children.values()
+            child.label = node.label + child.label
+            path[-2].children[node.label[0]] = child
+
+    def complete(self, prefix):
+        """Return every name whose key starts with prefix, in key order."""
+
+        key = prefix.lower()
+        node = self.root
+        i = 0
+        while i < len(key):
+            node = node.children.get(key[i])
+            if node is None:
+                return []
+            elif key.startswith(node.label, i):
+                i += len(node.label)
+            elif node.label.startswith(key[i:]):
+                break
+            else:
+                return []
+
+        names = []
+        to_visit = [node]
+        while to_visit:
+            node = to_visit.pop()
+            if node.value is not None:
+                names.append(node.value)
+            to_visit.extend(
+                node.children[c] for c in sorted(node.children, reverse=True)
+            )
+        return names
+
+
+class FuzzyMatcher:
+    """
+    Approximate name lookup. Exact (case-insensitive) matches are answered
+    from a dict; otherwise the names sharing the most trigrams with the query
+    are shortlisted and only those are scored with difflib, giving the same
+    result as difflib.get_close_matches for typical typos without comparing
+    against every name.
+
+    Names are numbered, and the trigram posting lists are arrays of those
+    numbers. Removed names are left in the posting lists and skipped until
+    they outnumber the names left, when the posting lists are rebuilt.
+    """
+
+    def __init__(self, names=None, candidates=32, cutoff=0.6):
+        self.candidates = candidates
+        self.cutoff = cutoff
+        self.exact = {}  # lowercase name -> name
+        self.keys = []  # number -> lowercase name, None once removed
+        self.ids = {}  # lowercase name -> number
+        self.grams = {}  # trigram -> array of numbers
+        self.prefixes = None  # PrefixTrie, built on the first completion
+
+        for name in names or []:
+            self.add(name)
+
+    def __getstate__(self):
+        # The trie is rebuilt when needed rather than stored
+        return {**self.__dict__, "prefixes": None}
+
+    def __contains__(self, name):
+        return name.lower() in self.exact
+
+    def __len__(self):
+        return len(self.exact)
+
+    @staticmethod
+    def grams_of(string):
+        # Pad so that short names and word boundaries still produce trigrams
+        return spellindex.ngrams(f"  {string} ")
+
+    def add(self, name):
+        key = name.lower()
+        if key not in self.exact:
+            self.ids[key] = len(self.keys)
+            self.keys.append(key)
+            for gram in FuzzyMatcher.grams_of(key):
+                if gram not in self.grams:
+                    self.grams[gram] = array.array("I")
+                self.grams[gram].append(self.ids[key])
+        self.exact[key] = name
+        if self.prefixes is not None:
+            self.prefixes.add(name)
+
+    def remove(self, name):
+        key = name.lower()
+        if self.exact.pop(key, None) is None:
+            return
+        if self.prefixes is not None:
+            self.prefixes.remove(name)
+
+        self.keys[self.ids.pop(key)] = None
+        if len(self.keys) > 2 * len(self.exact):
+            self.rebuild()
+
+    def rebuild(self):
+        names = list(self.exact.values())
+        self.exact = {}
+        self.keys = []
+        self.ids = {}
+        self.grams = {}
+        for name in names:
+            self.add(name)
+
+    def complete(self, prefix):
+        """Return every name starting with prefix, ignoring case."""
+
+        if self.prefixes is None:
+            self.prefixes = PrefixTrie(self.exact.values())
+        return self.prefixes.complete(prefix)
+
+    def shortlist(self, key):
+        counts = collections.Counter()
+        for gram in FuzzyMatcher.grams_of(key):
+            if gram in self.grams:
+                counts.update(self.grams[gram])
+
+        return [
+            self.keys[number]
+            for number, _ in heapq.nlargest(
+                self.candidates,
+                (
+                    (number, count)
+                    for number, count in counts.items()
+                    if self.keys[number] is not None
+                ),
+                key=lambda item: item[1],
+            )
+        ]
+
+    def scored_match(self, query):
+        """
+        Return (score, name) for the best match for query, scored by difflib
+        ratio, or None if nothing is close enough.
+        """
+
+        key = query.lower()
+        if key in self.exact:
+            return (1.0, self.exact[key])
+
+        # Mirrors the scoring in difflib.get_close_matches, ties included.
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(key)
+        best = None
+        for name in self.shortlist(key):
+            matcher.set_seq1(name)
+            if (
+                matcher.real_quick_ratio() >= self.cutoff
+                and matcher.quick_ratio() >= self.cutoff
+                and (score := matcher.ratio()) >= self.cutoff
+                and (best is None or (score, name) > best)
+            ):
+                best = (score, name)
+
+        return (best[0], self.exact[best[1]]) if best else None
+
+    def match(self, query):
+        best = self.scored_match(query)
+        return best[1] if best else None
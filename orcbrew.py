@@ -0,0 +1,272 @@
+import re
+
+import utilities
+
+SPELLS_KEY = "orcpub.dnd.e5/spells"
+
+CLASSES = [
+    "Bard",
+    "Cleric",
+    "Druid",
+    "Paladin",
+    "Ranger",
+    "Sorcerer",
+    "Warlock",
+    "Wizard",
+]
+
+WHITESPACE_REGEX = re.compile(r"(?:[\s,]+|;[^\n]*)*")
+STRING_REGEX = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"', re.S)
+ATOM_REGEX = re.compile(r'[^\s,{}\[\]()";]+')
+CHARACTER_REGEX = re.compile(r"\\(newline|return|space|tab|u[0-9a-fA-F]{4}|.)")
+INT_REGEX = re.compile(r"[+-]?\d+N?")
+FLOAT_REGEX = re.compile(r"[+-]?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?M?")
+ESCAPE_REGEX = re.compile(r"\\(u[0-9a-fA-F]{4}|.)", re.S)
+
+# Everything that can't change the nesting depth is matched in long runs, so
+# skipping a value doesn't need to tokenize it.
+SKIP_REGEX = re.compile(
+    r'[^"{}\[\]()\\;]+|"[^"\\]*(?:\\.[^"\\]*)*"|;[^\n]*|\\.|.', re.S
+)
+
+ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+CHARACTERS = {"newline": "\n", "return": "\r", "space": " ", "tab": "\t"}
+OPENING = {"{": "}", "[": "]", "(": ")", "#{": "}"}
+CLOSING = {"}", "]", ")"}
+LITERALS = {"nil": None, "true": True, "false": False}
+
+
+class EDNDecodeError(ValueError):
+    pass
+
+
+class Keyword(str):
+    """
+    EDN keyword, without the leading colon. Equal to the plain string, so
+    maps read from EDN can be indexed with e.g. spell["name"].
+    """
+
+
+class Reader:
+    """
+    Reads EDN, the format of orcbrew files, from a string. Values which
+    aren't needed can be skipped over without decoding them, and maps can be
+    read one key at a time, which makes picking out a small part of a large
+    file much cheaper than decoding all of it.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def error(self, message):
+        return EDNDecodeError(f"{message} at position {self.pos}.")
+
+    def peek(self):
+        self.pos = WHITESPACE_REGEX.match(self.text, self.pos).end()
+        if self.pos == len(self.text):
+            raise self.error("Unexpected end of file")
+        if self.text.startswith("#{", self.pos):
+            return "#{"
+        return self.text[self.pos]
+
+    def expect(self, delimiter):
+        if self.peek() != delimiter:
+            raise self.error(f"Expected {delimiter}")
+        self.pos += len(delimiter)
+
+    def at_end(self, closing):
+        if self.peek() == closing:
+            self.pos += 1
+            return True
+        return False
+
+    def read(self):
+        char = self.peek()
+        if char in OPENING:
+            self.pos += len(char)
+            closing = OPENING[char]
+            if char == "{":
+                value = {}
+                while not self.at_end(closing):
+                    key = self.read()
+                    value[key] = self.read()
+                return value
+
+            value = []
+            while not self.at_end(closing):
+                value.append(self.read())
+            return set(value) if char == "#{" else value
+        elif char == '"':
+            if not (match := STRING_REGEX.match(self.text, self.pos)):
+                raise self.error("Unterminated string")
+            self.pos = match.end()
+            string = match.group(1)
+            if "\\" in string:
+                string = ESCAPE_REGEX.sub(Reader.unescape, string)
+            return string
+        elif char == "\\":
+            match = CHARACTER_REGEX.match(self.text, self.pos)
+            self.pos = match.end()
+            name = match.group(1)
+            if len(name) == 5 and name[0] == "u":
+                return chr(int(name[1:], 16))
+            return CHARACTERS.get(name, name)
+        elif char == "#":
+            if self.text.startswith("#_", self.pos):
+                self.pos += 2
+                self.skip()
+                return self.read()
+
+            # Tagged element, e.g. #uuid "...", read as the untagged value
+            self.pos += 1
+            self.atom()
+            return self.read()
+        elif char in CLOSING:
+            raise self.error(f"Unexpected {char}")
+
+        return Reader.atom_value(self.atom())
+
+    def atom(self):
+        if not (match := ATOM_REGEX.match(self.text, self.pos)):
+            raise self.error("Unexpected character")
+        self.pos = match.end()
+        return match.group()
+
+    @staticmethod
+    def atom_value(atom):
+        if atom[0] == ":":
+            return Keyword(atom[1:])
+        elif atom in LITERALS:
+            return LITERALS[atom]
+        elif INT_REGEX.fullmatch(atom):
+            return int(atom.rstrip("N"))
+        elif FLOAT_REGEX.fullmatch(atom):
+            return float(atom.rstrip("M"))
+        return atom  # symbol
+
+    @staticmethod
+    def unescape(match):
+        escape = match.group(1)
+        if len(escape) == 5 and escape[0] == "u":
+            return chr(int(escape[1:], 16))
+        return ESCAPES.get(escape, escape)
+
+    def skip(self):
+        """Move past the next value without decoding it."""
+
+        if self.peek() not in OPENING:
+            self.read()  # Strings and atoms are cheap enough to just read
+            return
+
+        depth = 0
+        text = self.text
+        pos = self.pos
+        while match := SKIP_REGEX.match(text, pos):
+            pos = match.end()
+            token = match.group()
+            if token in OPENING:
+                depth += 1
+            elif token in CLOSING:
+                depth -= 1
+                if depth == 0:
+                    self.pos = pos
+                    return
+            elif token == '"' or token == "\\":
+                break
+
+        self.pos = pos
+        raise self.error("Unexpected end of file")
+
+    def keys(self):
+        """
+        Iterate over the keys of the map which is the next value. After each
+        key, the caller must read() or skip() the value before continuing.
+        """
+
+        self.expect("{")
+        while not self.at_end("}"):
+            yield self.read()
+
+
+def iter_spell_maps(text):
+    """
+    Yield the map for each spell in an orcbrew file, skipping everything
+    else. Handles both single and multiple plugin exports, which have a map
+    from plugin name to plugin at the top level.
+    """
+
+    reader = Reader(text)
+    for key in reader.keys():
+        if key == SPELLS_KEY:
+            yield from iter_spells_map(reader)
+        elif isinstance(key, Keyword):
+            reader.skip()
+        else:
+            for plugin_key in reader.keys():
+                if plugin_key == SPELLS_KEY:
+                    yield from iter_spells_map(reader)
+                else:
+                    reader.skip()
+
+
+def iter_spells_map(reader):
+    for _ in reader.keys():
+        yield reader.read()
+
+
+def to_spell_json(spell):
+    """Convert an orcbrew spell map to the spells.json format."""
+
+    spell_json = {
+        field: utilities.replace_unicode(spell[field])
+        if isinstance(spell[field], str)
+        else spell[field]
+        for field in [
+            "name",
+            "school",
+            "level",
+            "casting-time",
+            "range",
+            "description",
+        ]
+    }
+    spell_json["cast"] = spell_json.pop("casting-time")
+    spell_json["duration"] = spell.get("duration", "Instantaneous")
+
+    components = spell["components"]
+    component_string = ", ".join(
+        [
+            c[0].upper()
+            for c in ["verbal", "somatic", "material"]
+            if components.get(c)
+        ]
+    )
+    material = components.get("material-component")
+    if material:
+        component_string += f" ({material})"
+
+        # some of the entries end in a closing bracket
+        # for no discernible reason.
+        if component_string[-2:] == "))" and component_string.count(
+            "("
+        ) != component_string.count(")"):
+
+            component_string = component_string[:-1]
+    spell_json["components"] = component_string
+
+    spell_lists = spell["spell-lists"]
+    spell_json["classes"] = [c for c in CLASSES if spell_lists.get(c.lower())]
+
+    spell_json["ritual"] = False
+    spell_json["alt_names"] = []
+    spell_json["subclasses"] = []
+
+    return spell_json
+
+
+def iter_spells_json(text):
+    """Yield each spell in an orcbrew file in the spells.json format."""
+
+    for spell in iter_spell_maps(text):
+        yield to_spell_json(spell)
@@ -0,0 +1,79 @@
+import contextlib
+import shutil
+import signal
+import sys
+
+# Width used when output isn't to a terminal, e.g. when piped to a file
+NO_TTY_WIDTH = 80
+
+# Columns of the terminal, found on first use and again when it is resized
+width = None
+
+
+class Buffer:
+    """
+    Stands in for sys.stdout, holding everything written until it is flushed
+    and then writing it to the real stdout at once. input() flushes stdout
+    before prompting, so prompts partway through a command still appear after
+    what came before them.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.parts = []
+
+    def __getattr__(self, attr):
+        # fileno, isatty, encoding and so on are those of the real stdout
+        return getattr(self.stream, attr)
+
+    def write(self, text):
+        self.parts.append(text)
+        return len(text)
+
+    def flush(self):
+        if self.parts:
+            self.stream.write("".join(self.parts))
+            self.parts = []
+        self.stream.flush()
+
+
+@contextlib.contextmanager
+def buffered():
+    """Collect all output within the block into a single write."""
+
+    buffer = Buffer(sys.stdout)
+    sys.stdout = buffer
+    try:
+        yield buffer
+    finally:
+        sys.stdout = buffer.stream
+        buffer.flush()
+
+
+def interactive():
+    return sys.__stdout__ is not None and sys.__stdout__.isatty()
+
+
+def refresh_width(*_):
+    global width
+
+    if interactive():
+        width = shutil.get_terminal_size((NO_TTY_WIDTH, 0)).columns
+    else:
+        width = NO_TTY_WIDTH
+
+
+def terminal_width():
+    if width is None:
+        refresh_width()
+    return width
+
+
+def install():
+    """
+    Refresh the cached terminal width whenever the terminal is resized,
+    where the platform signals that. Must be called from the main thread.
+    """
+
+    if interactive() and hasattr(signal, "SIGWINCH"):
+        signal.signal(signal.SIGWINCH, refresh_width)
@@ -0,0 +1,401 @@
+import functools
+import re
+from typing import NamedTuple, Tuple
+
+import spellindex
+import utilities
+
+# Spell search language, e.g.
+#   cl: wizard (s: evocation or s=abjuration) not t: "saving throw"
+#
+# <field>:<text> matches spells whose field contains text, <field>=<text>
+# those whose field (or one of its values, for lists) is exactly text and
+# <field>~<regex> those whose field matches the regular expression. Terms are
+# combined with "and" (implied between adjacent terms), "or" or "|", "not" or
+# a leading "-", and grouped with parentheses. "rit" or "ritual" alone
+# matches ritual spells, "conc" or "concentration" concentration spells and
+# any other bare word searches spell names.
+#
+# Level, range, casting time and duration can also be compared numerically,
+# e.g. "r: >=60ft" or "d: <1h", as can the largest roll in the description,
+# e.g. "dice: >=8d6", and "sort: <field>" (or "sort: -<field>" for descending
+# order) orders the results.
+
+FIELD_ALIASES = {
+    "n": "name",
+    "s": "school",
+    "l": "level",
+    "c": "cast",
+    "r": "range",
+    "co": "components",
+    "d": "duration",
+    "t": "desc",
+    "rit": "ritual",
+    "class": "classes",
+    "cls": "classes",
+    "cl": "classes",
+    "subclass": "subclasses",
+    "scls": "subclasses",
+    "sc": "subclasses",
+}
+
+FIELDS = (
+    spellindex.SpellIndex.CATEGORICAL_FIELDS
+    + spellindex.SpellIndex.TEXT_FIELDS
+    + ["alt_names", "dice"]
+)
+SORT_FIELDS = list(spellindex.SpellIndex.NUMERIC_FIELDS) + ["name", "school"]
+
+CONTAINS = ":"
+EXACT = "="
+REGEX = "~"
+
+COMPARISON_REGEX = re.compile(r"^(<=|>=|<|>|==?)\s*(.+)$")
+TOKEN_REGEX = re.compile(r'\s*(?:([()])|"([^"]*)"?|([^\s()"]+))')
+TERM_REGEX = re.compile(r"^([a-z_]+)([:=~])(.*)$", re.IGNORECASE)
+
+
+class Term(NamedTuple):
+    field: str
+    op: str
+    value: str
+
+    def cost(self):
+        # Per spell checked: categorical fields are a few mask operations,
+        # substrings of three or more characters go through the trigram (or,
+        # for descriptions, word) postings and everything else is a scan.
+        # Descriptions are much longer than other fields.
+        if (
+            self.field in spellindex.SpellIndex.CATEGORICAL_FIELDS
+            or self.op in spellindex.COMPARISONS
+        ):
+            cost = 1
+        elif self.op == CONTAINS and len(self.value) >= spellindex.NGRAM_SIZE:
+            cost = 2
+        else:
+            cost = 4
+        return cost + 1 if self.field == "desc" else cost
+
+    def estimate(self, index):
+        return index.estimate(self.field, self.op, self.value)
+
+    def evaluate(self, index, within):
+        return index.term_mask(self.field, self.op, self.value, within)
+
+
+class And(NamedTuple):
+    children: Tuple
+
+    def cost(self):
+        return min((child.cost() for child in self.children), default=0)
+
+    def estimate(self, index):
+        return min(
+            (child.estimate(index) for child in self.children),
+            default=len(index),
+        )
+
+    def evaluate(self, index, within):
+        # The clauses expected to match the fewest spells in this index go
+        # first, cheapest first among equals, so that the others only have to
+        # check the spells which survived them.
+        children = sorted(
+            self.children,
+            key=lambda child: (child.estimate(index), child.cost()),
+        )
+        for child in children:
+            if not within:
+                break
+            within = child.evaluate(index, within)
+        return within
+
+
+class Or(NamedTuple):
+    children: Tuple
+
+    def cost(self):
+        return max((child.cost() for child in self.children), default=0)
+
+    def estimate(self, index):
+        return min(
+            len(index), sum(child.estimate(index) for child in self.children)
+        )
+
+    def evaluate(self, index, within):
+        result = 0
+        for child in self.children:
+            result |= child.evaluate(index, within & ~result)
+        return result
+
+
+class Not(NamedTuple):
+    child: Tuple
+
+    def cost(self):
+        return self.child.cost()
+
+    def estimate(self, index):
+        return len(index)
+
+    def evaluate(self, index, within):
+        return within & ~self.child.evaluate(index, within)
+
+
+class Sorted(NamedTuple):
+    plan: Tuple
+    field: str
+    descending: bool
+
+    def cost(self):
+        return self.plan.cost()
+
+    def estimate(self, index):
+        return self.plan.estimate(index)
+
+    def evaluate(self, index, within):
+        return self.plan.evaluate(index, within)
+
+
+def plan_order(node):
+    return (node.cost(), repr(node))
+
+
+def combine(cls, children):
+    flat = []
+    for child in children:
+        if isinstance(child, cls):
+            flat.extend(child.children)
+        else:
+            flat.append(child)
+
+    if len(flat) == 1:
+        return flat[0]
+    return cls(tuple(sorted(set(flat), key=plan_order)))
+
+
+def make_term(field, op, value):
+    field = FIELD_ALIASES.get(field.lower(), field.lower())
+    if field not in FIELDS:
+        raise ValueError(f"Invalid query term: {field}.")
+
+    if (
+        op == CONTAINS
+        and field in spellindex.SpellIndex.NUMERIC_FIELDS
+        and (match := COMPARISON_REGEX.match(value))
+    ):
+        comparison, quantity = match.groups()
+        if comparison == "=":
+            comparison = "=="
+        return Term(field, comparison, parse_comparand(field, quantity))
+    elif field == "dice":
+        raise ValueError('Compare dice with a roll, e.g. "dice: >=8d6".')
+    elif op == REGEX:
+        try:
+            re.compile(value)
+        except re.error as e:
+            raise ValueError(f'Invalid regular expression "{value}": {e}.')
+    else:
+        value = value.lower()
+
+    return Term(field, op, value)
+
+
+def parse_comparand(field, string):
+    string = string.strip().lower()
+    if field == "level":
+        try:
+            return float(string)
+        except ValueError:
+            raise ValueError(
+                f'Couldn\'t understand "{string}" as a level.'
+                ' Compare levels with a number, e.g. "l: >=3".'
+            ) from None
+
+    try:
+        # A plain number is a range in feet
+        if field == "range" and float(string) >= 0:
+            return float(string)
+    except ValueError:
+        pass
+
+    if field == "dice":
+        value = spellindex.parse_dice(string)
+    elif field == "range":
+        value = spellindex.parse_range(string)
+    elif field == "duration":
+        value = spellindex.parse_duration(string)
+    else:
+        value = spellindex.parse_casting_time(string)
+
+    if value is None and field == "dice":
+        raise ValueError(f'Couldn\'t understand "{string}" as a roll.')
+    elif value is None:
+        raise ValueError(
+            f'Couldn\'t understand "{string}" as a {field}.'
+            ' Include a unit, e.g. "r: >=60ft" or "d: <1h".'
+        )
+    return value
+
+
+def tokenize(string):
+    tokens = []
+    for paren, quoted, word in TOKEN_REGEX.findall(string):
+        if paren:
+            tokens.append(paren)
+        elif word:
+            tokens.append(word)
+        else:
+            tokens.append(("quoted", quoted))
+    return tokens
+
+
+class Parser:
+    def __init__(self, string):
+        self.tokens = tokenize(string)
+        self.i = 0
+        self.sort = None
+        self.extract_sort()
+
+    def extract_sort(self):
+        # "sort: <field>" may appear anywhere, but applies to the whole search
+        tokens = []
+        i = 0
+        while i < len(self.tokens):
+            token = self.tokens[i]
+            keyword = Parser.keyword(token) or ""
+            if keyword.startswith("sort:"):
+                field = token[len("sort:") :]
+                if not field and i + 1 < len(self.tokens):
+                    i += 1
+                    field = self.tokens[i]
+                    if isinstance(field, tuple):
+                        field = field[1]
+                self.set_sort(field)
+            else:
+                tokens.append(token)
+            i += 1
+        self.tokens = tokens
+
+    def set_sort(self, field):
+        descending = field.startswith("-")
+        field = field.lstrip("-").lower()
+        field = FIELD_ALIASES.get(field, field)
+        if field not in SORT_FIELDS:
+            raise ValueError(
+                f'Can\'t sort by "{field}". Sort by one of '
+                + utilities.punctuate_list(SORT_FIELDS)
+                + "."
+            )
+        self.sort = (field, descending)
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        self.i += 1
+        return token
+
+    @staticmethod
+    def keyword(token):
+        return token.lower() if isinstance(token, str) else None
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError(f'Unexpected "{self.peek()}" in search.')
+        if self.sort:
+            return Sorted(node, *self.sort)
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while Parser.keyword(self.peek()) in ("or", "|"):
+            self.next()
+            children.append(self.parse_and())
+        # An empty search matches everything, but an empty alternative is
+        # a mistake rather than a request for every spell
+        if len(children) > 1 and And(()) in children:
+            raise ValueError("Incomplete search.")
+        return combine(Or, children)
+
+    def parse_and(self):
+        children = []
+        while (token := self.peek()) is not None and token != ")":
+            if Parser.keyword(token) in ("or", "|"):
+                break
+            elif Parser.keyword(token) == "and":
+                self.next()
+            else:
+                children.append(self.parse_not())
+        return combine(And, children)
+
+    def parse_not(self):
+        token = self.peek()
+        if Parser.keyword(token) == "not":
+            self.next()
+            return Not(self.parse_not())
+        elif isinstance(token, str) and len(token) > 1 and token[0] == "-":
+            self.tokens[self.i] = token[1:]
+            return Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        token = self.next()
+        if token is None:
+            raise ValueError("Incomplete search.")
+        elif token == "(":
+            node = self.parse_or()
+            if self.next() != ")":
+                raise ValueError("Unbalanced parentheses in search.")
+            elif node == And(()):
+                raise ValueError("Incomplete search.")
+            return node
+        elif token == ")":
+            raise ValueError("Unbalanced parentheses in search.")
+        elif isinstance(token, tuple):
+            return make_term("name", CONTAINS, token[1])
+        elif Parser.keyword(token) in ("rit", "ritual"):
+            return Term("ritual", CONTAINS, "true")
+        elif Parser.keyword(token) in ("conc", "concentration"):
+            return Term("concentration", CONTAINS, "true")
+        elif match := TERM_REGEX.match(token):
+            field, op, value = match.groups()
+            if not value:
+                value = self.next()
+                if value is None or value in ("(", ")"):
+                    raise ValueError(
+                        'Format: "search <attribute>:<criteria>".'
+                    )
+                elif isinstance(value, tuple):
+                    value = value[1]
+            return make_term(field, op, value)
+        else:
+            return make_term("name", CONTAINS, token)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_query(string):
+    """
+    Parse a search string into a plan of Term, And, Or and Not nodes, wrapped
+    in a Sorted node if the search specifies an order. Equal searches compile
+    to equal plans, so plans can be used as cache keys.
+    Raises ValueError if the search is malformed.
+    """
+
+    return Parser(string).parse()
+
+
+def ranking_text(node):
+    """
+    Return the text of the description substring terms a plan requires, by
+    which its results can be ranked, or "" if there are none.
+    """
+
+    if isinstance(node, Term):
+        if node.field == "desc" and node.op == CONTAINS:
+            return node.value
+        return ""
+    elif isinstance(node, (Not, Sorted)):
+        return ""
+    return " ".join(filter(None, map(ranking_text, node.children)))
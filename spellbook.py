@@ -1,57 +1,274 @@
-import difflib
+import collections
+import hashlib
+import heapq
+import itertools
+import json
+import re
+import sys
+import threading
+from typing import List, NamedTuple, Optional, Tuple
 
 import cli
 import dataloaders
-import utilities
+import fuzzy
+import query
+import spellindex
+import spellstore
+
+
+# Rolls in spell descriptions, except the amount they scale by at higher level
+DICE_REGEX = re.compile(r"(?<!increases by )\d+d\d+")
+
+
+class SearchResults(NamedTuple):
+    spells: List["Spell"]
+    scores: Optional[List[float]]  # relevance of each spell, if ranked
+    total: int  # number of matches, including any beyond the limit
 
 
 class Spellbook:
-    def __init__(self):
-        self.build_spellbook()
+    # Attributes restored from the on disk snapshot instead of being rebuilt
+    SNAPSHOT_ATTRIBUTES = [
+        "spells",
+        "matcher",
+        "index",
+        "digests",
+        "file_digests",
+    ]
+
+    # Number of distinct searches to remember the results of
+    QUERY_CACHE_SIZE = 128
+
+    def __init__(self, spells=None, background=False):
+        """
+        Load the spellbook in spells.json or, if spells is given, build one
+        from those spells alone.
+
+        With background, spells.json is parsed on another thread. Exact name
+        lookups are answered as soon as that spell has been read, while
+        anything else waits for the load to finish.
+        """
+
+        self.query_cache = collections.OrderedDict()
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+
+        self.loader = None
+        self.load_error = None
+        self.loading = {}  # lowercase name -> spell read so far, then None
+        self.progress = threading.Condition()
+
+        # (mtime, size) of spells.json when it was last read or written
+        self.file_stat = None
+
+        if spells is None:
+            self.build_spellbook(background)
+        else:
+            self.build_from(spells)
+
+    def __getattr__(self, attr):
+        # Only reached for these while a background load is running
+        if attr in Spellbook.SNAPSHOT_ATTRIBUTES and self.loader is not None:
+            self.wait()
+            return getattr(self, attr)
+        raise AttributeError(attr)
+
+    def build_spellbook(self, background=False):
+        self.invalidate_query_cache()
+        self.file_stat = dataloaders.spells_file_stat()
+
+        if (state := dataloaders.load_spellbook_snapshot()) is not None:
+            self.__dict__.update(state)
+            return
+
+        spells = dataloaders.iter_spells()
+        if background:
+            self.loader = threading.Thread(
+                target=self.load, args=(spells,), daemon=True
+            )
+            self.loader.start()
+        else:
+            self.load(spells)
+            self.wait()
 
-    def build_spellbook(self):
+    def load(self, spells):
         try:
-            self.spells = {
-                spell["name"]: Spell.from_json(spell)
-                for spell in dataloaders.get_spells()
+            # Built separately so that the finished state appears at once
+            book = Spellbook(self.stream(spells))
+            book.file_digests = dict(book.digests)
+            book.save_snapshot()
+            self.__dict__.update(
+                {
+                    attr: getattr(book, attr)
+                    for attr in Spellbook.SNAPSHOT_ATTRIBUTES
+                }
+            )
+        except Exception as e:
+            self.load_error = e
+
+        with self.progress:
+            self.loading = None
+            self.progress.notify_all()
+
+    def stream(self, spells):
+        for data in spells:
+            spell = Spell.from_json(data)
+            with self.progress:
+                for name in (spell.name, *spell.alt_names):
+                    self.loading[name.lower()] = spell
+                self.progress.notify_all()
+            yield spell
+
+    def wait_for_spell(self, name):
+        """
+        Wait until the background load has read the spell called name, and
+        return it, or return None if the load finished without finding it.
+        """
+
+        key = name.lower()
+        with self.progress:
+            self.progress.wait_for(
+                lambda: self.loading is None or key in self.loading
+            )
+            if self.loading is None:
+                return None
+            return self.loading[key]
+
+    def wait(self):
+        """Block until a background load has finished."""
+
+        if self.loader is not None:
+            self.loader.join()
+            self.loader = None
+
+        if self.load_error is not None:
+            raise ValueError("Spellbook file corrupted") from self.load_error
+
+    def load_failed(self):
+        """Return whether a background load has finished with an error."""
+
+        return self.load_error is not None and self.loading is None
+
+    def __contains__(self, name):
+        return name.lower() in self.spells
+
+    def build_from(self, spells):
+        self.invalidate_query_cache()
+
+        # Lowercase name or alt name -> spell
+        self.spells = {}
+
+        # Used to resolve misspelt spell names
+        self.matcher = fuzzy.FuzzyMatcher()
+
+        self.index = spellindex.SpellIndex()
+
+        # Lowercase name -> digest, used to tell which spells changed when
+        # reloading spells.json
+        self.digests = {}
+
+        # Digests of the spells as they are in spells.json, so that reloading
+        # leaves spells which haven't been saved to it alone
+        self.file_digests = {}
+
+        self.put_spells(spells)
+
+    def save_snapshot(self):
+        # The snapshot stands in for spells.json, so it can't include spells
+        # which haven't been saved to it
+        if self.digests != self.file_digests:
+            return
+
+        dataloaders.save_spellbook_snapshot(
+            {
+                attr: getattr(self, attr)
+                for attr in Spellbook.SNAPSHOT_ATTRIBUTES
             }
+        )
 
-            alt_names = {}
-            for spell in self.spells.values():
-                if spell.alt_names:
-                    for name in spell.alt_names:
-                        alt_names[name] = spell
-            self.spells.update(alt_names)
+    def search(self, string, limit=None):
+        """
+        Return the SearchResults for a search string. Searches including
+        description text are ranked by relevance, and only the best limit
+        results are returned if a limit is given.
+        """
 
-            self.names = list(self.spells.keys())
+        plan = query.compile_query(string)
+        key = (plan, limit)
 
-            # Used to match queries through difflib
-            self._names = [name.lower() for name in self.names]
-        except Exception as e:
-            raise ValueError from e
-
-    def handle_query(self, query):
-        queries = utilities.parse_spell_query(query)
-
-        results = []
-        for spell in self.spells.values():
-            for q in queries:
-                try:
-                    if not queries[q] in str(getattr(spell, q)).lower():
-                        break
-                except AttributeError as e:
-                    raise ValueError(f"Invalid query term: {q}.") from e
-            else:
-                results.append(spell)
+        if key in self.query_cache:
+            self.query_cache_hits += 1
+            self.query_cache.move_to_end(key)
+        else:
+            self.query_cache_misses += 1
+            self.query_cache[key] = self.run_query(plan, limit)
+            if len(self.query_cache) > Spellbook.QUERY_CACHE_SIZE:
+                self.query_cache.popitem(last=False)
+
+        return self.query_cache[key]
+
+    def run_query(self, plan, limit):
+        if isinstance(plan, query.Sorted):
+            spells = self.index.search(plan, (plan.field, plan.descending))
+            return SearchResults(spells, None, len(spells))
+
+        spells = self.index.search(plan)
+        if not (text := query.ranking_text(plan)):
+            return SearchResults(spells, None, len(spells))
+
+        ranked = self.index.rank(spells, text, limit)
+        return SearchResults(
+            [spell for _, spell in ranked],
+            [score for score, _ in ranked],
+            len(spells),
+        )
+
+    def handle_query(self, string):
+        return list(self.search(string).spells)
+
+    def query_cache_info(self):
+        return (
+            f"Search cache: {self.query_cache_hits} hits,"
+            f" {self.query_cache_misses} misses,"
+            f" {len(self.query_cache)}/{Spellbook.QUERY_CACHE_SIZE} entries."
+        )
+
+    def invalidate_query_cache(self):
+        self.query_cache.clear()
+
+    def scored_match(self, query):
+        """Return (score, spell) for the best match for query, or None."""
+
+        if self.loader is not None:
+            if (spell := self.wait_for_spell(query)) is not None:
+                return (1.0, spell)
+            self.wait()
 
-        return results
+        if match := self.matcher.scored_match(query):
+            return (match[0], self.spells[match[1].lower()])
+        return None
 
     def get_spell(self, query):
-        target = difflib.get_close_matches(query.lower(), self._names, 1)
-        if target:
-            return self.spells[self.names[self._names.index(target[0])]]
-        else:
-            return None
+        match = self.scored_match(query)
+        return match[1] if match else None
+
+    def complete(self, prefix):
+        """Return the names and alt names starting with prefix."""
+
+        if self.loader is not None:
+            # Don't hold up tab completion on the load; offer what's been
+            # read so far instead.
+            with self.progress:
+                if self.loading is not None:
+                    key = prefix.lower()
+                    return sorted(
+                        name
+                        for spell in set(self.loading.values())
+                        for name in (spell.name, *spell.alt_names)
+                        if name.lower().startswith(key)
+                    )
+
+        return self.matcher.complete(prefix)
 
     def get_spells(self, queries):
         spells = []
@@ -60,47 +277,406 @@ class Spellbook:
         return spells
 
     def add_spell(self, spell):
-        if spell.name in self.names and not cli.get_decision(
-            f"{spell.name} is already in your spellbook."
-            " Would you like to replace it?"
-        ):
-            return
+        self.add_spells([spell])
 
-        self.spells[spell.name] = spell
+    def add_spells(self, spells):
+        """
+        Add spells, asking before replacing a spell of the same name. The
+        indexes are updated once for all of the spells.
+        """
 
-        if spell.name not in self.names:
-            self.names.append(spell.name)
-            self._names.append(spell.name)
+        self.put_spells(
+            [
+                spell
+                for spell in spells
+                if spell.name not in self
+                or cli.get_decision(
+                    f"{spell.name} is already in your spellbook."
+                    " Would you like to replace it?"
+                )
+            ]
+        )
 
-    def add_spells(self, spells):
+    def put_spell(self, spell, digest=None):
+        """Add spell, replacing any spell of the same name without asking."""
+
+        self.put_spells([spell], [digest])
+
+    def put_spells(self, spells, digests=None):
+        """
+        Add spells, replacing any spells of the same name without asking,
+        with digests giving each spell's digest if it is already known.
+        """
+
+        self.invalidate_query_cache()
+
+        added = {}  # lowercase name -> (spell, digest)
+        for spell, digest in zip(spells, digests or itertools.repeat(None)):
+            added[spell.name.lower()] = (spell, digest)
+
+        self.discard_spells(
+            [self.spells[key] for key in added if key in self.digests]
+        )
+        self.index.add_all([spell for spell, _ in added.values()])
+
+        # Names take precedence over alt names
+        for key, (spell, digest) in added.items():
+            self.digests[key] = digest or spell.digest()
+            self.spells[key] = spell
+            self.matcher.add(spell.name)
+        for spell, _ in added.values():
+            for name in spell.alt_names:
+                if name.lower() not in self.spells:
+                    self.spells[name.lower()] = spell
+                    self.matcher.add(name)
+
+    def remove_spell(self, name):
+        self.remove_spells([name])
+
+    def remove_spells(self, names):
+        self.invalidate_query_cache()
+        self.discard_spells([self.spells[name.lower()] for name in names])
+
+    def discard_spells(self, spells):
+        self.index.remove_all(spells)
         for spell in spells:
-            self.add_spell(spell)
+            self.digests.pop(spell.name.lower(), None)
+            for name in (spell.name, *spell.alt_names):
+                if self.spells.get(name.lower()) is spell:
+                    del self.spells[name.lower()]
+                    self.matcher.remove(name)
+
+    def mark_saved(self):
+        """Record that the spellbook has just been written to spells.json."""
+
+        self.file_digests = dict(self.digests)
+        self.file_stat = dataloaders.spells_file_stat()
+
+    def reload(self):
+        """
+        Bring the spellbook up to date with spells.json, applying only the
+        spells which were added, changed or removed in the file since it was
+        last read or written. Spells which haven't been saved to the file are
+        kept. Returns a summary of the changes, or None if the file hasn't
+        changed, e.g. because the app wrote it.
+        """
+
+        stat = dataloaders.spells_file_stat()
+        if stat is not None and stat == self.file_stat:
+            return None
+
+        spells = {}
+        for data in dataloaders.iter_spells(prompt_download=False):
+            spell = Spell.from_json(data)
+            spells[spell.name.lower()] = (spell, spell.digest())
+
+        # Removed from the file, and not edited since it was read
+        removed = [
+            key
+            for key, digest in self.file_digests.items()
+            if key not in spells and self.digests.get(key) == digest
+        ]
+        self.remove_spells(removed)
+
+        added = changed = 0
+        updated = []
+        for key, (spell, digest) in spells.items():
+            if key not in self.file_digests:
+                added += 1
+            elif self.file_digests[key] != digest:
+                changed += 1
+            else:
+                continue
+            if self.digests.get(key) != digest:
+                updated.append((spell, digest))
+        self.put_spells(
+            [spell for spell, _ in updated], [digest for _, digest in updated]
+        )
+
+        self.file_digests = {key: digest for key, (_, digest) in spells.items()}
+        self.file_stat = stat
+        if added or changed or removed:
+            self.save_snapshot()
+
+        return (
+            f"{added} spells added, {changed} changed"
+            f" and {len(removed)} removed."
+        )
+
+    def iter_spells_json(self):
+        # Alt names map to the same Spell objects, so dedup by identity
+        unique = {id(spell): spell for spell in self.spells.values()}
+        for spell in sorted(unique.values(), key=lambda sp: sp.name):
+            yield spell.to_json()
 
     def get_spells_json(self):
-        unique_check = []
-        spells = []
-        for spell in self.spells.values():
-            if not spell in unique_check:
-                spells.append(spell.to_json())
-                unique_check.append(spell)
+        return list(self.iter_spells_json())
+
+
+class LayeredSpellbook:
+    """
+    Stack of spellbooks searched as one, e.g. the core spells.json with
+    homebrew packs on top. Each layer keeps its own indexes, so layers can be
+    attached and detached without rebuilding the others. A spell hides any
+    spells of the same name in the layers below it.
+
+    The bottom layer is the spellbook from spells.json, which anything not
+    specific to layers, such as adding spells or saving, is delegated to.
+    """
+
+    CORE_LAYER = "spells.json"
+
+    def __init__(self, core):
+        self.core = core
+        self.layers = [(LayeredSpellbook.CORE_LAYER, None, core)]
+
+    def __getattr__(self, attr):
+        if attr == "core":
+            raise AttributeError(attr)
+        return getattr(self.core, attr)
+
+    def __contains__(self, name):
+        return any(name in book for _, _, book in self.layers)
+
+    def layer_names(self):
+        return [name for name, _, _ in self.layers]
+
+    def layer_paths(self):
+        return [path for _, path, _ in self.layers[1:]]
+
+    def attach(self, name, path, book):
+        if name in self.layer_names():
+            raise ValueError(f'There is already a layer named "{name}".')
+        self.layers.append((name, path, book))
+
+    def detach(self, name):
+        if name == LayeredSpellbook.CORE_LAYER:
+            raise ValueError(f"{name} can't be detached.")
+
+        for i, (layer_name, _, _) in enumerate(self.layers):
+            if layer_name == name:
+                del self.layers[i]
+                return
+        raise ValueError(f'No layer named "{name}".')
+
+    def visible(self, spell, level):
+        # Only a spell's name hides others, not its alt names
+        return not any(
+            spell.name.lower() in book.digests
+            for _, _, book in self.layers[level + 1 :]
+        )
+
+    def search(self, string, limit=None):
+        if len(self.layers) == 1:
+            return self.core.search(string, limit)
+
+        plan = query.compile_query(string)
+        matches = []  # (score, spell)
+        for level, (_, _, book) in enumerate(self.layers):
+            results = book.search(string)
+            scores = results.scores or [None] * len(results.spells)
+            matches.extend(
+                (score, spell)
+                for score, spell in zip(scores, results.spells)
+                if self.visible(spell, level)
+            )
+
+        total = len(matches)
+        if isinstance(plan, query.Sorted):
+            spells = LayeredSpellbook.sort(
+                [spell for _, spell in matches], plan.field, plan.descending
+            )
+            return SearchResults(spells, None, total)
+        elif not query.ranking_text(plan):
+            # In the order spells.json is saved in, as when there's one layer
+            spells = sorted(
+                [spell for _, spell in matches], key=lambda spell: spell.name
+            )
+            return SearchResults(spells, None, total)
+
+        # Scores are relative to each layer's own statistics, which is close
+        # enough for ordering a handful of results.
+        if limit is not None:
+            matches = heapq.nlargest(limit, matches, key=lambda m: m[0])
+        else:
+            matches = sorted(matches, key=lambda m: m[0], reverse=True)
+        return SearchResults(
+            [spell for _, spell in matches],
+            [score for score, _ in matches],
+            total,
+        )
+
+    @staticmethod
+    def sort(spells, field, descending):
+        if field in spellindex.SpellIndex.NUMERIC_FIELDS:
+            value = spellindex.SpellIndex.NUMERIC_FIELDS[field]
+            tiebreak = spellindex.SpellIndex.SORT_TIEBREAKS.get(
+                field, lambda spell: 0
+            )
+            keyed = [(value(spell), spell) for spell in spells]
+            known = [item for item in keyed if item[0] is not None]
+            known.sort(
+                key=lambda item: (item[0], tiebreak(item[1])),
+                reverse=descending,
+            )
+            return [spell for _, spell in known] + [
+                spell for key, spell in keyed if key is None
+            ]
+
+        return sorted(
+            spells,
+            key=lambda spell: spellindex.SpellIndex.field_text(spell, field),
+            reverse=descending,
+        )
+
+    def handle_query(self, string):
+        return list(self.search(string).spells)
+
+    def get_spell(self, query):
+        best = None
+        for _, _, book in reversed(self.layers):
+            match = book.scored_match(query)
+            if match and (best is None or match[0] > best[0]):
+                best = match
+                if best[0] == 1.0:
+                    break  # Exact; can't be beaten by lower layers
+        return best[1] if best else None
+
+    def get_spells(self, queries):
+        return [self.get_spell(spell) for spell in queries]
+
+    def complete(self, prefix):
+        names = {}
+        for _, _, book in self.layers:
+            for name in book.complete(prefix):
+                names.setdefault(name.lower(), name)
+        return [names[key] for key in sorted(names)]
+
+    def query_cache_info(self):
+        return "\n".join(
+            f"{name}: {book.query_cache_info()}"
+            for name, _, book in self.layers
+        )
+
+
+class Dice(NamedTuple):
+    rolls: Tuple[str, ...]  # each distinct roll in a description, in order
+    offsets: Tuple[int, ...]  # index of the end of the first of each roll
+
+    @staticmethod
+    def of(desc):
+        rolls = {}
+        for match in DICE_REGEX.finditer(desc):
+            rolls.setdefault(match.group(), match.end())
+        return Dice(tuple(rolls), tuple(rolls.values()))
+
+    def annotate(self, desc):
+        """Return desc with the option number after each roll."""
+
+        parts = []
+        start = 0
+        for i, offset in enumerate(self.offsets):
+            parts.append(desc[start:offset])
+            parts.append(f" [{i + 1}]")
+            start = offset
+        parts.append(desc[start:])
+        return "".join(parts)
+
+    def largest(self):
+        """Return the average of the largest roll, or None if there are none."""
+
+        return max(map(spellindex.parse_dice, self.rolls), default=None)
 
-        return sorted(spells, key=lambda sp: sp["name"])
+
+class LazyField:
+    """
+    Spell attribute which may hold a spellstore.Blob, decoded from the mapped
+    spellbook store on each access rather than kept in memory.
+    """
+
+    def __set_name__(self, owner, name):
+        self.attr = f"_{name}"
+
+    def __get__(self, spell, owner=None):
+        if spell is None:
+            return self
+
+        value = getattr(spell, self.attr)
+        if isinstance(value, spellstore.Blob):
+            return value.decode()
+        return value
+
+    def __set__(self, spell, value):
+        setattr(spell, self.attr, value)
+
+
+# Canonical instances of the class lists shared between spells
+_interned_lists = {}
+
+
+def intern(value):
+    """
+    Return a shared instance of a repeated string, or of a list of strings as
+    a tuple, so that spells don't each hold their own copies.
+    """
+
+    if isinstance(value, str):
+        return sys.intern(value)
+    elif isinstance(value, (list, tuple)):
+        key = tuple(intern(v) for v in value)
+        return _interned_lists.setdefault(key, key)
+    return value
 
 
 class Spell:
+    LAZY_FIELDS = ["components", "desc", "classes", "subclasses"]
+
+    __slots__ = [
+        "name",
+        "school",
+        "level",
+        "cast",
+        "range",
+        "_components",
+        "duration",
+        "_desc",
+        "ritual",
+        "_classes",
+        "_subclasses",
+        "alt_names",
+        "_dice",
+    ]
+
+    components = LazyField()
+    desc = LazyField()
+    classes = LazyField()
+    subclasses = LazyField()
+
     def __init__(self, **kwargs):
         self.name = kwargs.get("name", "N/A")
-        self.school = kwargs.get("school", "N/A")
+        self.school = intern(kwargs.get("school", "N/A"))
         self.level = kwargs.get("level", -1)
-        self.cast = kwargs.get("cast", "N/A")
-        self.range = kwargs.get("range", "N/A")
-        self.components = kwargs.get("components", "N/A")
-        self.duration = kwargs.get("duration", "N/A")
+        self.cast = intern(kwargs.get("cast", "N/A"))
+        self.range = intern(kwargs.get("range", "N/A"))
+        self.components = intern(kwargs.get("components", "N/A"))
+        self.duration = intern(kwargs.get("duration", "N/A"))
         self.desc = kwargs.get("description", "N/A")
         self.ritual = kwargs.get("ritual", False)
-        self.classes = kwargs.get("classes", [])
-        self.subclasses = kwargs.get("subclasses", [])
-        self.alt_names = kwargs.get("alt_names", [])
+        self.classes = intern(kwargs.get("classes", []))
+        self.subclasses = intern(kwargs.get("subclasses", []))
+        self.alt_names = tuple(kwargs.get("alt_names", ()))
+        self._dice = None
+
+    @property
+    def concentration(self):
+        return "concentration" in self.duration.lower()
+
+    @property
+    def dice(self):
+        # Extracted on first use, which for indexed spells is when indexing
+        if self._dice is None:
+            self._dice = Dice.of(self.desc)
+        return self._dice
 
     def __str__(self):
         return f'\n{self.name} | {self.school}\
@@ -118,11 +694,16 @@ class Spell:
             "duration": self.duration,
             "description": self.desc,
             "ritual": self.ritual,
-            "classes": self.classes,
-            "subclasses": self.subclasses,
-            "alt_names": self.alt_names,
+            "classes": list(self.classes),
+            "subclasses": list(self.subclasses),
+            "alt_names": list(self.alt_names),
         }
 
+    def digest(self):
+        return hashlib.sha1(
+            json.dumps(self.to_json(), sort_keys=True).encode()
+        ).hexdigest()
+
     @staticmethod
     def from_json(data):
         return Spell(**data)
@@ -0,0 +1,663 @@
+import array
+import bisect
+import collections
+import heapq
+import math
+import re
+
+NGRAM_SIZE = 3
+
+# BM25 parameters, the usual defaults
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+WORD_REGEX = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+COMPARISONS = ["<", "<=", ">", ">=", "=="]
+
+QUANTITY_REGEX = re.compile(r"(\d+(?:\.\d+)?)\s*-?\s*([a-z]+)")
+DICE_REGEX = re.compile(r"^(\d*)d(\d+)$")
+
+# Multipliers to convert to feet and seconds respectively
+DISTANCE_UNITS = {
+    "ft": 1,
+    "foot": 1,
+    "feet": 1,
+    "mi": 5280,
+    "mile": 5280,
+    "miles": 5280,
+}
+TIME_UNITS = {
+    "s": 1,
+    "sec": 1,
+    "second": 1,
+    "seconds": 1,
+    "action": 6,
+    "actions": 6,
+    "bonus": 6,
+    "reaction": 6,
+    "rnd": 6,
+    "round": 6,
+    "rounds": 6,
+    "min": 60,
+    "minute": 60,
+    "minutes": 60,
+    "h": 3600,
+    "hr": 3600,
+    "hour": 3600,
+    "hours": 3600,
+    "day": 86400,
+    "days": 86400,
+    "year": 31536000,
+    "years": 31536000,
+}
+
+# Actions, bonus actions and reactions all take a round. When sorting, a
+# reaction comes before a bonus action, which comes before anything else
+# taking the same time.
+CASTING_TIME_RANKS = {"reaction": 0, "bonus": 1}
+
+
+def ngrams(string, n=NGRAM_SIZE):
+    return {string[i : i + n] for i in range(len(string) - n + 1)}
+
+
+def words(string):
+    return WORD_REGEX.findall(string.lower())
+
+
+def parse_quantity(string, units):
+    for number, unit in QUANTITY_REGEX.findall(string.lower()):
+        if unit in units:
+            return float(number) * units[unit]
+    return None
+
+
+def parse_range(string):
+    """Return a spell range in feet, or None if it has no distance."""
+
+    if (feet := parse_quantity(string, DISTANCE_UNITS)) is not None:
+        return feet
+
+    string = string.lower()
+    if string.startswith("self"):
+        return 0.0
+    elif string.startswith("touch"):
+        return 5.0
+    return None
+
+
+def parse_casting_time(string):
+    """Return a casting time in seconds, or None if it is irregular."""
+
+    return parse_quantity(string, TIME_UNITS)
+
+
+def casting_time_rank(string):
+    """Return the order of a casting time among those taking as long."""
+
+    for _, unit in QUANTITY_REGEX.findall(string.lower()):
+        if unit in TIME_UNITS:
+            return CASTING_TIME_RANKS.get(unit, len(CASTING_TIME_RANKS))
+    return len(CASTING_TIME_RANKS)
+
+
+def parse_duration(string):
+    """Return a spell duration in seconds, or None if it is irregular."""
+
+    string = string.lower()
+    if string.startswith("instant"):
+        return 0.0
+    elif "until dispelled" in string or "permanent" in string:
+        return math.inf
+    return parse_quantity(string, TIME_UNITS)
+
+
+def parse_dice(string):
+    """Return the average of a roll like "8d6", or of a plain number."""
+
+    string = string.strip().lower()
+    if match := DICE_REGEX.match(string):
+        count, sides = match.groups()
+        return int(count or 1) * (int(sides) + 1) / 2
+    try:
+        return float(string)
+    except ValueError:
+        return None
+
+
+def ordinals_of(mask):
+    """Return the positions of the set bits of mask, in ascending order."""
+
+    bits = bin(mask)[:1:-1]
+    ordinals = []
+    i = bits.find("1")
+    while i != -1:
+        ordinals.append(i)
+        i = bits.find("1", i + 1)
+    return ordinals
+
+
+class SortedColumn:
+    """
+    Numeric attribute of the spells in an index, both as an array by ordinal
+    (NaN where a spell has no value) and as ordinals sorted by value, so that
+    comparisons and ordering can be answered with bisect.
+    """
+
+    def __init__(self):
+        self.values = array.array("d")
+        self.keys = array.array("d")
+        self.ordinals = array.array("l")
+
+    def add(self, ordinal, value):
+        self.add_all([(ordinal, value)])
+
+    def add_all(self, items):
+        """Add (ordinal, value) pairs, where ordinals are new and ascending."""
+
+        if not items:
+            return
+
+        self.values.extend([math.nan] * (items[-1][0] + 1 - len(self.values)))
+        known = []
+        for ordinal, value in items:
+            if value is None:
+                value = math.nan
+            self.values[ordinal] = value
+            if not math.isnan(value):
+                known.append((value, ordinal))
+
+        if len(known) < 8:
+            for value, ordinal in known:
+                i = bisect.bisect_right(self.keys, value)
+                self.keys.insert(i, value)
+                self.ordinals.insert(i, ordinal)
+            return
+
+        # Stable, so equal values stay in ordinal order as with bisect_right
+        merged = list(zip(self.keys, self.ordinals)) + known
+        merged.sort(key=lambda item: item[0])
+        self.keys = array.array("d", [value for value, _ in merged])
+        self.ordinals = array.array("l", [ordinal for _, ordinal in merged])
+
+    def remove(self, ordinal):
+        self.remove_all([ordinal])
+
+    def remove_all(self, ordinals):
+        removed = {}  # ordinal -> value
+        for ordinal in ordinals:
+            if not math.isnan(value := self.values[ordinal]):
+                removed[ordinal] = value
+            self.values[ordinal] = math.nan
+
+        if len(removed) < 8:
+            for ordinal, value in removed.items():
+                i = bisect.bisect_left(self.keys, value)
+                while self.ordinals[i] != ordinal:
+                    i += 1
+                del self.keys[i]
+                del self.ordinals[i]
+            return
+
+        kept = [
+            i
+            for i, ordinal in enumerate(self.ordinals)
+            if ordinal not in removed
+        ]
+        self.keys = array.array("d", [self.keys[i] for i in kept])
+        self.ordinals = array.array("l", [self.ordinals[i] for i in kept])
+
+    def compare(self, op, value):
+        """Return the ordinals with values satisfying (<value> op value)."""
+
+        if op == "<":
+            return self.ordinals[: bisect.bisect_left(self.keys, value)]
+        elif op == "<=":
+            return self.ordinals[: bisect.bisect_right(self.keys, value)]
+        elif op == ">":
+            return self.ordinals[bisect.bisect_right(self.keys, value) :]
+        elif op == ">=":
+            return self.ordinals[bisect.bisect_left(self.keys, value) :]
+        return self.ordinals[
+            bisect.bisect_left(self.keys, value) : bisect.bisect_right(
+                self.keys, value
+            )
+        ]
+
+
+class SpellIndex:
+    """
+    Search index over a collection of spells, each identified by an ordinal.
+
+    Categorical fields, which have a small set of values, keep an integer
+    bitmask of ordinals per value, so those terms are answered by OR-ing the
+    masks of the values containing the criteria and AND-ing across terms.
+
+    Other free text fields keep an inverted index from trigrams to ordinals.
+    A substring query intersects the posting lists of its trigrams and then
+    confirms the surviving candidates with a plain substring test.
+
+    Descriptions are indexed by word instead, with the occurrences of each
+    word in each description so that matches can be ranked by BM25. Their
+    substring queries take candidates from the posting lists of the words
+    the substring can be part of.
+
+    Posting lists are arrays of ordinals in ascending order, which take a
+    fraction of the memory of sets of ints. Searches are evaluated as masks,
+    see query.compile_query.
+    """
+
+    CATEGORICAL_FIELDS = [
+        "school",
+        "level",
+        "ritual",
+        "concentration",
+        "classes",
+        "subclasses",
+    ]
+    TEXT_FIELDS = ["name", "cast", "range", "components", "duration", "desc"]
+    NGRAM_FIELDS = ["name", "cast", "range", "components", "duration"]
+    NUMERIC_FIELDS = {
+        "level": lambda spell: float(spell.level),
+        "range": lambda spell: parse_range(spell.range),
+        "cast": lambda spell: parse_casting_time(spell.cast),
+        "duration": lambda spell: parse_duration(spell.duration),
+        "dice": lambda spell: spell.dice.largest(),
+    }
+    # Orders spells with equal values of a numeric field when sorting
+    SORT_TIEBREAKS = {
+        "cast": lambda spell: casting_time_rank(spell.cast),
+    }
+
+    def __init__(self, spells=None):
+        self.spells = []  # ordinal -> spell, None once removed
+        self.ordinals = {}  # spell -> ordinal
+        self.live = 0  # mask of ordinals not removed
+        self.masks = {field: {} for field in SpellIndex.CATEGORICAL_FIELDS}
+        self.postings = {field: {} for field in SpellIndex.NGRAM_FIELDS}
+        self.columns = {
+            field: SortedColumn() for field in SpellIndex.NUMERIC_FIELDS
+        }
+        # word -> (ordinals, occurrences in each of their descriptions)
+        self.terms = {}
+        self.lengths = array.array("I")  # ordinal -> words in description
+        self.total_length = 0
+
+        self.add_all(spells or [])
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    @staticmethod
+    def field_text(spell, field):
+        return str(getattr(spell, field)).lower()
+
+    @staticmethod
+    def field_values(spell, field):
+        value = getattr(spell, field)
+        if isinstance(value, (list, tuple)):
+            return {str(v).lower() for v in value}
+        return {str(value).lower()}
+
+    def add(self, spell):
+        self.add_all([spell])
+
+    def add_all(self, spells):
+        """
+        Add spells to the index. Each mask and column is updated once for the
+        whole batch rather than once per spell.
+        """
+
+        added = {}  # field -> value -> [ordinal]
+        grams_added = {field: {} for field in self.postings}
+        words_added = {}  # word -> ([ordinal], [occurrences])
+        numeric = {field: [] for field in self.columns}
+        ordinals = []
+        for spell in spells:
+            if spell in self.ordinals:
+                continue
+
+            ordinal = len(self.spells)
+            self.spells.append(spell)
+            self.ordinals[spell] = ordinal
+            ordinals.append(ordinal)
+
+            for field in self.masks:
+                values = added.setdefault(field, {})
+                for value in SpellIndex.field_values(spell, field):
+                    values.setdefault(value, []).append(ordinal)
+
+            for field, grams in grams_added.items():
+                for gram in ngrams(SpellIndex.field_text(spell, field)):
+                    grams.setdefault(gram, []).append(ordinal)
+
+            for field, items in numeric.items():
+                items.append((ordinal, SpellIndex.NUMERIC_FIELDS[field](spell)))
+
+            desc = words(spell.desc)
+            self.lengths.append(len(desc))
+            self.total_length += len(desc)
+            for word, count in collections.Counter(desc).items():
+                word_ordinals, counts = words_added.setdefault(word, ([], []))
+                word_ordinals.append(ordinal)
+                counts.append(count)
+
+        for field, values in added.items():
+            masks = self.masks[field]
+            for value, value_ordinals in values.items():
+                masks[value] = masks.get(value, 0) | self.mask_of(
+                    value_ordinals
+                )
+        for field, grams in grams_added.items():
+            postings = self.postings[field]
+            for gram, gram_ordinals in grams.items():
+                if gram not in postings:
+                    postings[gram] = array.array("I")
+                postings[gram].extend(gram_ordinals)
+        for word, (word_ordinals, counts) in words_added.items():
+            if word not in self.terms:
+                self.terms[word] = (array.array("I"), array.array("I"))
+            self.terms[word][0].extend(word_ordinals)
+            self.terms[word][1].extend(counts)
+        for field, items in numeric.items():
+            self.columns[field].add_all(items)
+        self.live |= self.mask_of(ordinals)
+
+    def remove(self, spell):
+        self.remove_all([spell])
+
+    def remove_all(self, spells):
+        removed = {}  # field -> value -> [ordinal]
+        grams_removed = {field: set() for field in self.postings}
+        words_removed = set()
+        ordinals = []
+        for spell in spells:
+            ordinal = self.ordinals.pop(spell, None)
+            if ordinal is None:
+                continue
+
+            self.spells[ordinal] = None
+            ordinals.append(ordinal)
+
+            for field in self.masks:
+                values = removed.setdefault(field, {})
+                for value in SpellIndex.field_values(spell, field):
+                    values.setdefault(value, []).append(ordinal)
+
+            for field, grams in grams_removed.items():
+                grams.update(ngrams(SpellIndex.field_text(spell, field)))
+
+            self.total_length -= self.lengths[ordinal]
+            self.lengths[ordinal] = 0
+            words_removed.update(words(spell.desc))
+
+        # Each posting list is filtered once for the whole batch
+        gone = set(ordinals)
+        for field, grams in grams_removed.items():
+            postings = self.postings[field]
+            for gram in grams & postings.keys():
+                kept = array.array(
+                    "I", [o for o in postings[gram] if o not in gone]
+                )
+                if kept:
+                    postings[gram] = kept
+                else:
+                    del postings[gram]
+        for word in words_removed & self.terms.keys():
+            kept = [
+                (o, count)
+                for o, count in zip(*self.terms[word])
+                if o not in gone
+            ]
+            if kept:
+                self.terms[word] = (
+                    array.array("I", [o for o, _ in kept]),
+                    array.array("I", [count for _, count in kept]),
+                )
+            else:
+                del self.terms[word]
+
+        for field, values in removed.items():
+            masks = self.masks[field]
+            for value, value_ordinals in values.items():
+                if value in masks:
+                    masks[value] &= ~self.mask_of(value_ordinals)
+                    if not masks[value]:
+                        del masks[value]
+        for column in self.columns.values():
+            column.remove_all(ordinals)
+        self.live &= ~self.mask_of(ordinals)
+
+    def mask_of(self, ordinals):
+        bits = bytearray((len(self.spells) + 7) // 8)
+        for ordinal in ordinals:
+            bits[ordinal >> 3] |= 1 << (ordinal & 7)
+        return int.from_bytes(bits, "little")
+
+    def candidates(self, field, criteria):
+        """
+        Return the set of ordinals which may have criteria as a substring of
+        a free text field, or None if it can't be resolved through the index.
+        """
+
+        if field == "desc":
+            return self.word_candidates(criteria)
+
+        grams = ngrams(criteria)
+        if field not in self.postings or not grams:
+            return None
+
+        postings = self.postings[field]
+        posting_lists = []
+        for gram in grams:
+            if gram not in postings:
+                return set()
+            posting_lists.append(postings[gram])
+
+        posting_lists.sort(key=len)
+        result = set(posting_lists[0])
+        for posting_list in posting_lists[1:]:
+            result.intersection_update(posting_list)
+            if not result:
+                break
+        return result
+
+    def word_postings(self, criteria):
+        """
+        Return, for each word in criteria, the posting lists of the
+        description words it can be part of, or None if criteria can't be
+        resolved through the words. Words within criteria must match whole,
+        but the first may end a longer word and the last may start one.
+        """
+
+        # Apostrophes join words, e.g. "creature's", so can't be split on
+        matches = list(WORD_REGEX.finditer(criteria))
+        if "'" in criteria or not matches:
+            return None
+
+        postings = []
+        for match in matches:
+            word = match.group()
+            open_start = match.start() == 0
+            open_end = match.end() == len(criteria)
+            if open_start and open_end:
+                fits = lambda term: word in term
+            elif open_start:
+                fits = lambda term: term.endswith(word)
+            elif open_end:
+                fits = lambda term: term.startswith(word)
+            else:
+                postings.append(
+                    [self.terms[word][0]] if word in self.terms else []
+                )
+                continue
+            postings.append(
+                [
+                    ordinals
+                    for term, (ordinals, _) in self.terms.items()
+                    if fits(term)
+                ]
+            )
+        return postings
+
+    def word_candidates(self, criteria):
+        if (postings := self.word_postings(criteria)) is None:
+            return None
+
+        # The rarest words first, to narrow the candidates soonest
+        postings.sort(key=lambda lists: sum(map(len, lists)))
+        result = None
+        for lists in postings:
+            matched = set().union(*lists)
+            result = matched if result is None else result & matched
+            if not result:
+                break
+        return result
+
+    def term_mask(self, field, op, value, within):
+        """
+        Return the mask of the spells in within whose field matches value
+        under op, one of query.CONTAINS, query.EXACT, query.REGEX or, for a
+        numeric field, one of COMPARISONS.
+        """
+
+        if op in COMPARISONS:
+            return self.mask_of(self.columns[field].compare(op, value)) & within
+
+        if op == "~":
+            regex = re.compile(value, re.IGNORECASE)
+            match = lambda text: regex.search(text) is not None
+        elif op == "=":
+            match = lambda text: text == value
+        else:
+            match = lambda text: value in text
+
+        if field in self.masks:
+            mask = 0
+            for field_value, value_mask in self.masks[field].items():
+                if match(field_value):
+                    mask |= value_mask
+            return mask & within
+
+        candidates = None
+        if op == ":":
+            candidates = self.candidates(field, value)
+
+        if candidates is None:
+            ordinals = ordinals_of(within)
+        elif len(candidates) < within.bit_count():
+            ordinals = [o for o in candidates if within >> o & 1]
+        else:
+            ordinals = [o for o in ordinals_of(within) if o in candidates]
+
+        return self.mask_of(
+            o
+            for o in ordinals
+            if match(SpellIndex.field_text(self.spells[o], field))
+        )
+
+    def estimate(self, field, op, value):
+        """
+        Return an upper bound on the number of spells a term_mask call would
+        match, from the masks, columns and posting lists alone.
+        """
+
+        if op in COMPARISONS:
+            return len(self.columns[field].compare(op, value))
+        elif field in self.masks:
+            return self.term_mask(field, op, value, self.live).bit_count()
+        elif op == ":" and field in self.postings and (grams := ngrams(value)):
+            postings = self.postings[field]
+            return min(len(postings.get(gram, ())) for gram in grams)
+        elif op == ":" and field == "desc":
+            if (postings := self.word_postings(value)) is not None:
+                return min(
+                    min(len(self), sum(map(len, lists))) for lists in postings
+                )
+        return len(self)
+
+    def search(self, plan, order=None):
+        """
+        Return the spells matching a plan from query.compile_query, in book
+        order or sorted by order, a (field, descending) pair.
+        """
+
+        mask = plan.evaluate(self, self.live)
+        if order:
+            return self.sort(mask, *order)
+        return [self.spells[o] for o in ordinals_of(mask)]
+
+    def rank(self, spells, text, k=None):
+        """
+        Score spells by the BM25 relevance of their descriptions to the words
+        of text. Returns the k best (score, spell) pairs, or all of them if k
+        is None, best first.
+        """
+
+        ordinals = {self.ordinals[spell] for spell in spells}
+        n = len(self.ordinals)
+        average_length = (self.total_length / n if n else 0) or 1
+
+        scores = dict.fromkeys(ordinals, 0.0)
+        for word in set(words(text)):
+            if word not in self.terms:
+                continue
+
+            word_ordinals, counts = self.terms[word]
+            idf = math.log(
+                1 + (n - len(word_ordinals) + 0.5) / (len(word_ordinals) + 0.5)
+            )
+            if len(word_ordinals) < len(ordinals):
+                matches = [
+                    (o, tf)
+                    for o, tf in zip(word_ordinals, counts)
+                    if o in scores
+                ]
+            else:
+                # Posting lists are sorted, so look each spell up by bisection
+                matches = []
+                for o in ordinals:
+                    i = bisect.bisect_left(word_ordinals, o)
+                    if i < len(word_ordinals) and word_ordinals[i] == o:
+                        matches.append((o, counts[i]))
+
+            for ordinal, tf in matches:
+                length = self.lengths[ordinal] / average_length
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length)
+                scores[ordinal] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        # Ties keep book order
+        order = lambda item: (item[1], -item[0])
+        if k is None:
+            best = sorted(scores.items(), key=order, reverse=True)
+        else:
+            best = heapq.nlargest(k, scores.items(), key=order)
+        return [(score, self.spells[ordinal]) for ordinal, score in best]
+
+    def sort(self, mask, field, descending=False):
+        """
+        Return the spells in mask ordered by field. Spells without a value for
+        a numeric field come last.
+        """
+
+        ordinals = ordinals_of(mask)
+        if field in self.columns:
+            matched = set(ordinals)
+            column = self.columns[field]
+            ordered = [o for o in column.ordinals if o in matched]
+            if field in SpellIndex.SORT_TIEBREAKS:
+                tiebreak = SpellIndex.SORT_TIEBREAKS[field]
+                ordered.sort(
+                    key=lambda o: (column.values[o], tiebreak(self.spells[o]))
+                )
+            if descending:
+                ordered.reverse()
+            ordered.extend(o for o in ordinals if math.isnan(column.values[o]))
+        else:
+            ordered = sorted(
+                ordinals,
+                key=lambda o: SpellIndex.field_text(self.spells[o], field),
+                reverse=descending,
+            )
+        return [self.spells[o] for o in ordered]
@@ -2,68 +2,100 @@
 
 import os
 
-if os.name == "posix":
-    import readline  # avoid arrow keys inputting escape characters
-
 import dataloaders
 
 dataloaders.ensure_module_installed("roll")
 
 import char
 import cli
+import completion
 import context
+import output
 import spellbook
+import spellserver
+import watcher
+
 
-try:
+# Spawned worker processes import this module as well
+if __name__ == "__main__":
     try:
-        sb = spellbook.Spellbook()  # Utility for retrieving spell information
-    except ValueError:
-        print("Spellbook file corrupted. No Spellbook available.")
+        try:
+            # Utility for retrieving spell information, either from a running
+            # spellserver.py or loaded in the background
+            sb = spellserver.open_spellbook(background=True)
+        except ValueError:
+            print("Spellbook file corrupted. No Spellbook available.")
+            sb = None
+    except FileNotFoundError:
+        print("Warning: No Spellbook available.")
         sb = None
-except FileNotFoundError:
-    print("Warning: No Spellbook available.")
-    sb = None
 
-cache = dataloaders.get_cache()
-cfg = dataloaders.get_config()
-c = None  # Current player character
+    cache = dataloaders.get_cache()
+    cfg = dataloaders.get_config()
 
-if cfg["load_previous_char"] and cache["character"]:
-    try:
-        data = dataloaders.load_character_from_path(cache["character"])
-        if data is not None:
-            data.update({"sb": sb})
-            c = char.Char.from_json(data)
-            print(f"Character loaded: {str(c)}.")
-    except FileNotFoundError:
-        pass
+    if sb is not None:
+        sb = spellbook.LayeredSpellbook(sb)
+        for path in cache.get("spellbook_layers", []):
+            try:
+                sb.attach(
+                    os.path.basename(path),
+                    path,
+                    dataloaders.load_spell_layer(path),
+                )
+            except ValueError as e:
+                print(f"Failed to load spellbook layer: {e}")
 
-context = context.Context(sb, cfg, c)
-if c is not None:
-    context.save_file = cache.get("character", "")
-    context.save_files = cache.get("save_files", [])
+    c = None  # Current player character
 
-graceless = False  # allow ^C to exit if user has been warned
-while True:
-    try:
-        context.get_input()
-        graceless = False
-    except KeyboardInterrupt:  # Handle ^C during input
-        print()
+    if cfg["load_previous_char"] and cache["character"]:
+        try:
+            data = dataloaders.load_character_from_path(cache["character"])
+            if data is not None:
+                data.update({"sb": sb})
+                c = char.Char.from_json(data)
+                print(f"Character loaded: {str(c)}.")
+        except FileNotFoundError:
+            pass
+
+    context = context.Context(sb, cfg, c)
+    completion.install(context)
+    output.install()
+    # The spellbook server watches spells.json itself
+    if (
+        sb is not None
+        and isinstance(sb.core, spellbook.Spellbook)
+        and cfg["watch_spellbook"]
+    ):
+        context.spellbook_watcher = watcher.FileWatcher(
+            dataloaders.spells_file()
+        ).start()
+    if c is not None:
+        context.save_file = cache.get("character", "")
+        context.save_files = cache.get("save_files", [])
 
+    graceless = False  # allow ^C to exit if user has been warned
+    while True:
         try:
-            if graceless or cli.get_decision("Exit gracelessly?"):
-                exit()
-        except KeyboardInterrupt:  # Allow repeated ^C to confirm
+            context.get_input()
+            graceless = False
+        except KeyboardInterrupt:  # Handle ^C during input
             print()
-            exit()
 
-    try:
-        context.handle_command()
-    except KeyboardInterrupt:  # Allow breaking out of dialogs with ^C
-        print(
-            " Command cancelled."
-            "\n^C again to exit without saving, or use"
-            ' "exit" to exit gracefully.'
-        )
-        graceless = True
+            try:
+                if graceless or cli.get_decision("Exit gracelessly?"):
+                    exit()
+            except KeyboardInterrupt:  # Allow repeated ^C to confirm
+                print()
+                exit()
+
+        try:
+            # All of a command's output is written at once, when it finishes
+            with output.buffered():
+                context.handle_command()
+        except KeyboardInterrupt:  # Allow breaking out of dialogs with ^C
+            print(
+                " Command cancelled."
+                "\n^C again to exit without saving, or use"
+                ' "exit" to exit gracefully.'
+            )
+            graceless = True
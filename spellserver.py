@@ -0,0 +1,286 @@
+#!/bin/python3
+
+# Resident spellbook shared by every spells.py session on this machine, so
+# that the book is loaded and indexed once rather than once per session.
+# Run it with:
+#   python3 spellserver.py
+# Sessions started while it is running query it over a Unix socket, and load
+# the spellbook themselves as usual when it isn't running.
+
+import json
+import os
+import socket
+import socketserver
+import threading
+
+import cli
+import dataloaders
+import spellbook
+import watcher
+
+
+def spell_json(spell):
+    return spell.to_json() if spell is not None else None
+
+
+def spell_from_json(data):
+    return spellbook.Spell.from_json(data) if data is not None else None
+
+
+def search(book, string, limit=None):
+    results = book.search(string, limit)
+    return {
+        "spells": [spell.to_json() for spell in results.spells],
+        "scores": results.scores,
+        "total": results.total,
+    }
+
+
+def scored_match(book, query):
+    match = book.scored_match(query)
+    return [match[0], match[1].to_json()] if match else None
+
+
+def put_spells(book, spells, digests=None):
+    book.put_spells([spellbook.Spell.from_json(s) for s in spells], digests)
+
+
+# Requests a client can make, as method name -> handler
+METHODS = {
+    "complete": lambda book, prefix: book.complete(prefix),
+    "contains": lambda book, name: name in book,
+    "digests": lambda book: book.digests,
+    "get_spell": lambda book, query: spell_json(book.get_spell(query)),
+    "mark_saved": lambda book: book.mark_saved(),
+    "put_spells": put_spells,
+    "query_cache_info": lambda book: book.query_cache_info(),
+    "reload": lambda book: book.reload(),
+    "remove_spells": lambda book, names: book.remove_spells(names),
+    "save_snapshot": lambda book: book.save_snapshot(),
+    "scored_match": scored_match,
+    "search": search,
+    "spells_json": lambda book: book.get_spells_json(),
+}
+
+
+class SpellbookServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Answers requests from SpellbookClients, one JSON object per line each
+    way, against a single in-process Spellbook. spells.json is watched and
+    reloaded between requests, as the app does between commands.
+    """
+
+    # As socketserver.UnixStreamServer, which only exists where it works
+    address_family = getattr(socket, "AF_UNIX", None)
+    daemon_threads = True
+
+    def __init__(self, path, book):
+        self.book = book
+        self.lock = threading.Lock()
+        self.watcher = watcher.FileWatcher(dataloaders.spells_file()).start()
+        super().__init__(path, SpellbookRequestHandler)
+
+    def dispatch(self, method, args):
+        with self.lock:
+            if self.watcher.changed() and (summary := self.book.reload()):
+                print(f"Reloaded spells.json: {summary}")
+
+            if method not in METHODS:
+                raise ValueError(f'Unknown method "{method}".')
+            return METHODS[method](self.book, *args)
+
+
+class SpellbookRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = {
+                    "result": self.server.dispatch(
+                        request["method"], request.get("args", [])
+                    )
+                }
+            except Exception as e:
+                response = {"error": str(e) or type(e).__name__}
+
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class SpellbookClient:
+    """
+    Spellbook which forwards to a SpellbookServer. Spells are sent as JSON,
+    so each lookup returns a new Spell object.
+
+    Only the methods used on the core layer of a LayeredSpellbook are
+    forwarded; spells, matcher and index stay in the server, and layers come
+    from the LayeredSpellbook wrapped around the client. digests fetches the
+    whole map, so callers should read it once rather than per spell.
+    """
+
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(path)
+        except OSError:
+            self.socket.close()
+            raise
+        self.file = self.socket.makefile("rwb")
+
+    def call(self, method, *args):
+        try:
+            self.file.write(
+                json.dumps({"method": method, "args": args}).encode() + b"\n"
+            )
+            self.file.flush()
+            line = self.file.readline()
+        except OSError as e:
+            raise ValueError("Lost connection to the spellbook server") from e
+
+        if not line:
+            raise ValueError("Lost connection to the spellbook server")
+
+        response = json.loads(line)
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    def __contains__(self, name):
+        return self.call("contains", name)
+
+    @property
+    def digests(self):
+        return self.call("digests")
+
+    def search(self, string, limit=None):
+        results = self.call("search", string, limit)
+        return spellbook.SearchResults(
+            [spellbook.Spell.from_json(s) for s in results["spells"]],
+            results["scores"],
+            results["total"],
+        )
+
+    def handle_query(self, string):
+        return list(self.search(string).spells)
+
+    def query_cache_info(self):
+        return f"Server {self.call('query_cache_info')}"
+
+    def scored_match(self, query):
+        if match := self.call("scored_match", query):
+            return (match[0], spellbook.Spell.from_json(match[1]))
+        return None
+
+    def get_spell(self, query):
+        return spell_from_json(self.call("get_spell", query))
+
+    def get_spells(self, queries):
+        return [self.get_spell(spell) for spell in queries]
+
+    def complete(self, prefix):
+        return self.call("complete", prefix)
+
+    def add_spell(self, spell):
+        self.add_spells([spell])
+
+    def add_spells(self, spells):
+        self.put_spells(
+            [
+                spell
+                for spell in spells
+                if spell.name not in self
+                or cli.get_decision(
+                    f"{spell.name} is already in your spellbook."
+                    " Would you like to replace it?"
+                )
+            ]
+        )
+
+    def put_spell(self, spell, digest=None):
+        self.put_spells([spell], [digest])
+
+    def put_spells(self, spells, digests=None):
+        self.call("put_spells", [spell.to_json() for spell in spells], digests)
+
+    def remove_spell(self, name):
+        self.remove_spells([name])
+
+    def remove_spells(self, names):
+        self.call("remove_spells", list(names))
+
+    def reload(self):
+        return self.call("reload")
+
+    def mark_saved(self):
+        self.call("mark_saved")
+
+    def load_failed(self):
+        # The server loads the spellbook before it accepts connections
+        return False
+
+    def save_snapshot(self):
+        self.call("save_snapshot")
+
+    def iter_spells_json(self):
+        return iter(self.call("spells_json"))
+
+    def get_spells_json(self):
+        return self.call("spells_json")
+
+
+def socket_file():
+    return dataloaders.ensure_path(
+        dataloaders.RESOURCE_DIR, dataloaders.RESOURCE_SPELLBOOK_SOCKET_FILE
+    )
+
+
+def connect():
+    """Return a SpellbookClient, or None if no server is running."""
+
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_file()):
+        return None
+
+    try:
+        return SpellbookClient(socket_file())
+    except OSError:
+        return None
+
+
+def open_spellbook(background=False):
+    """
+    Return a client for the spellbook server if one is running, or else
+    load the spellbook in this process.
+    """
+
+    return connect() or spellbook.Spellbook(background=background)
+
+
+def serve():
+    if not hasattr(socket, "AF_UNIX"):
+        print("Unix sockets aren't supported on this platform.")
+        return
+
+    path = socket_file()
+    if connect() is not None:
+        print("A spellbook server is already running.")
+        return
+    if os.path.exists(path):
+        os.remove(path)  # Left behind by a server which didn't exit cleanly
+
+    try:
+        book = spellbook.Spellbook()
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Failed to load spells.json: {e}")
+        return
+
+    with SpellbookServer(path, book) as server:
+        print(f"Serving {len(book.digests)} spells on {path}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print()
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,155 @@
+import copyreg
+import gc
+import io
+import mmap
+import pickle
+import struct
+
+import spellbook
+
+# Layout of a store file:
+#   MAGIC | header length (u64) | pickled meta | pickled state | blob region
+# The meta is a small object describing the state, read on its own so that a
+# stale store can be rejected without loading the rest. The state is the
+# pickled spellbook. The large spell fields (Spell.LAZY_FIELDS) aren't stored
+# in it; they are written to the blob region once per distinct value and the
+# state holds their offsets, so a loaded spellbook reads them from the mapped
+# file only when they are accessed.
+MAGIC = b"SPELLBK\x04"
+HEADER = struct.Struct("<8sQ")
+
+LIST_SEPARATOR = "\x1f"
+
+
+class Blob:
+    __slots__ = ["store", "offset", "length", "is_list"]
+
+    def __init__(self, store, offset, length, is_list):
+        self.store = store
+        self.offset = offset
+        self.length = length
+        self.is_list = is_list
+
+    def data(self):
+        return self.store.read(self.offset, self.length)
+
+    def decode(self):
+        text = self.data().decode("utf-8")
+        if self.is_list:
+            return tuple(text.split(LIST_SEPARATOR)) if text else ()
+        return text
+
+
+class Store:
+    """
+    A store file opened for reading. Its meta is read on opening, and its
+    state only by load().
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, header_length = HEADER.unpack_from(self.map)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a spellbook store.")
+            self.blob_start = HEADER.size + header_length
+
+            self.file.seek(HEADER.size)
+            self.unpickler = _Unpickler(self.file, self)
+            self.meta = self.unpickler.load()
+        except Exception:
+            self.close()
+            raise
+
+    def read(self, offset, length):
+        start = self.blob_start + offset
+        return self.map[start : start + length]
+
+    def load(self):
+        # Unpickling creates a lot of objects and none of them are garbage,
+        # so collecting while it runs would only slow it down
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.unpickler.load()
+        except Exception:
+            self.close()
+            raise
+        finally:
+            if enabled:
+                gc.enable()
+
+    def close(self):
+        self.file.close()
+
+
+class _StoreRef:
+    """Stands in for the Store that the blobs being written will belong to."""
+
+
+def _current_store():
+    raise pickle.UnpicklingError("Blobs can only be loaded from a store.")
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, f):
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.blobs = io.BytesIO()
+        self.blob_offsets = {}  # (data, is_list) -> Blob
+        self.store = _StoreRef()
+
+    def blob(self, value):
+        if isinstance(value, Blob):
+            # Copied as is from the store it was loaded from
+            key = (value.data(), value.is_list)
+        else:
+            is_list = isinstance(value, (list, tuple))
+            text = LIST_SEPARATOR.join(value) if is_list else value
+            key = (text.encode(), is_list)
+
+        if key not in self.blob_offsets:
+            data, is_list = key
+            self.blob_offsets[key] = Blob(
+                self.store, self.blobs.tell(), len(data), is_list
+            )
+            self.blobs.write(data)
+        return self.blob_offsets[key]
+
+    def reducer_override(self, obj):
+        if obj is self.store:
+            # Pickled once and memoised, so loading each blob is a plain
+            # object construction with no Python calls
+            return (_current_store, ())
+        elif type(obj) is not spellbook.Spell:
+            return NotImplemented
+
+        state = {slot: getattr(obj, slot) for slot in obj.__slots__}
+        for field in spellbook.Spell.LAZY_FIELDS:
+            state[f"_{field}"] = self.blob(getattr(obj, f"_{field}"))
+        # Recomputed from the description when it's needed
+        state["_dice"] = None
+        return (copyreg.__newobj__, (spellbook.Spell,), (None, state))
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, f, store):
+        super().__init__(f)
+        self.store = store
+
+    def find_class(self, module, name):
+        if (module, name) == (__name__, "_current_store"):
+            return lambda: self.store
+        return super().find_class(module, name)
+
+
+def dump(meta, state, path):
+    header = io.BytesIO()
+    pickler = _Pickler(header)
+    pickler.dump(meta)
+    pickler.dump(state)
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, header.tell()))
+        f.write(header.getbuffer())
+        f.write(pickler.blobs.getbuffer())
@@ -3,30 +3,36 @@ import difflib
 import subprocess
 
 
+def wrap_lines(string, width, indent=""):
+    """
+    Wrap string to lines of at most width characters, breaking at spaces
+    and keeping any line breaks already in it. Lines after the first start
+    with indent, within the width. Words too long for a line get one alone.
+    """
+
+    lines = []
+    for paragraph in string.split("\n"):
+        line = []
+        length = -1  # of the words in line joined with spaces
+        for word in paragraph.split(" "):
+            if not word and not line:
+                continue  # Lines don't start with spaces
+            limit = width - len(indent) if lines else width
+            if word and line and length + 1 + len(word) > limit:
+                lines.append(" ".join(line).strip())
+                line = []
+                length = -1
+            line.append(word)
+            length += 1 + len(word)
+        lines.append(" ".join(line).strip())
+
+    return lines[:1] + [indent + line if line else "" for line in lines[1:]]
+
+
 def printable_paragraph(string, width):
+    # Wrapped paragraphs start on a new line
     if len(string) > width:
-        out = ""
-        line = ""
-        word = ""
-        for c in string:
-            if len(line) + len(word) > width:
-                out += "\n" + line.strip()
-                line = ""
-
-            if c == " ":
-                line += f" {word}"
-                word = ""
-            elif c == "\n":
-                line += f" {word}"
-                word = ""
-                out += "\n" + line.strip()
-                line = ""
-            else:
-                word += c
-
-        out += "\n" + (line + " " + word).strip()
-
-        return out
+        return "\n" + "\n".join(wrap_lines(string, width))
     else:
         return string
 
@@ -51,66 +57,6 @@ def clear_screen():
         os.system("clear")
 
 
-# Parse a string like "school:evocation time:action"
-def parse_spell_query(string):
-    string += " "
-
-    queries = {}
-
-    query_shortenings = {
-        "n": "name",
-        "s": "school",
-        "l": "level",
-        "c": "cast",
-        "r": "range",
-        "co": "components",
-        "d": "duration",
-        "t": "desc",
-        "rit": "ritual",
-        "range": "range",
-        "class": "classes",
-        "cls": "classes",
-        "cl": "classes",
-        "subclass": "subclasses",
-        "scls": "subclasses",
-        "sc": "subclasses",
-    }
-
-    quote = False
-    colon = False
-    query = ""
-    criteria = ""
-    for c in string:
-        if c == " ":
-            if not quote and criteria:
-                colon = False
-
-                if query and criteria:
-                    if query in query_shortenings:
-                        query = query_shortenings[query]
-                    queries[query.lower()] = criteria.lower()
-                query = ""
-                criteria = ""
-            elif query in ["rit", "ritual"]:
-                queries["ritual"] = "true"
-            elif colon and quote:
-                criteria += c
-        elif c == '"':
-            if colon:
-                quote = not quote
-            else:
-                raise ValueError('Format: "search <attribute>:<criteria>".')
-        elif c == ":" and not quote:
-            colon = True
-        else:
-            if colon:
-                criteria += c
-            else:
-                query += c
-
-    return queries
-
-
 def suggest_command(command, commands):
     suggestion = difflib.get_close_matches(command, commands, 1)
     if suggestion:
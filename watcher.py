@@ -0,0 +1,103 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+INOTIFY_EVENT = struct.Struct("iIII")
+
+POLL_INTERVAL = 2  # seconds, when inotify is unavailable
+
+
+class FileWatcher:
+    """
+    Watches a file from a background thread and records when it changes.
+    Changes aren't acted on from the watching thread; the owner calls
+    changed() when it is safe to reload, e.g. between commands.
+
+    Uses inotify on Linux, watching the parent directory so that files
+    replaced by rename are noticed, and polls the mtime and size elsewhere.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        fd = self.inotify_fd()
+        if fd is None:
+            target = self.poll
+            args = ()
+        else:
+            target = self.watch_inotify
+            args = (fd,)
+
+        self.thread = threading.Thread(target=target, args=args, daemon=True)
+        self.thread.start()
+        return self
+
+    def changed(self):
+        """Return whether the file has changed since the last call."""
+
+        if self.event.is_set():
+            self.event.clear()
+            return True
+        return False
+
+    def stat(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def poll(self):
+        last = self.stat()
+        while True:
+            threading.Event().wait(POLL_INTERVAL)
+            if (current := self.stat()) != last:
+                last = current
+                self.event.set()
+
+    def inotify_fd(self):
+        if not hasattr(os, "uname") or os.uname().sysname != "Linux":
+            return None
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init()
+            if fd < 0:
+                return None
+
+            mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+            directory = os.path.dirname(self.path).encode()
+            if libc.inotify_add_watch(fd, directory, mask) < 0:
+                os.close(fd)
+                return None
+        except (OSError, AttributeError):
+            return None
+
+        return fd
+
+    def watch_inotify(self, fd):
+        name = os.path.basename(self.path).encode()
+        while True:
+            try:
+                data = os.read(fd, 4096)
+            except OSError:
+                return
+
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                event_name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+
+                if event_name == name:
+                    self.event.set()